@@ -0,0 +1,70 @@
+import hashlib
+import os
+import zipfile
+import numpy as np
+
+from consts import CACHE_DIR
+
+# Counts of cache lookups this run, for the startup report
+stats = {"hits": 0, "misses": 0}
+
+
+def cache_key(*parts) -> str:
+    # Stable digest of everything an asset is built from: source text, file
+    # bytes, parameters, the GL driver
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+def file_key(path: str, *parts) -> str:
+    with open(path, "rb") as f:
+        return cache_key(f.read(), *parts)
+
+def _path(name: str, key: str, ext: str) -> str:
+    return os.path.join(CACHE_DIR, f"{name}-{key}{ext}")
+
+def _write(path: str, write) -> None:
+    # Write beside the target and rename, so a crash never leaves half a file.
+    # A cache that cannot be written just means building again next time.
+    temp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(temp, "wb") as f:
+            write(f)
+        os.replace(temp, path)
+    except OSError:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+
+def cached_arrays(name: str, key: str, build) -> list[np.ndarray]:
+    # build() returns a list of arrays, stored together uncompressed. A file
+    # that is missing, empty or corrupt is just built again.
+    path = _path(name, key, ".npz")
+    try:
+        with np.load(path) as data:
+            arrays = [data[f"arr_{i}"] for i in range(len(data.files))]
+        stats["hits"] += 1
+        return arrays
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        pass
+    stats["misses"] += 1
+    arrays = build()
+    _write(path, lambda f: np.savez(f, *arrays))
+    return arrays
+
+def load_blob(name: str, key: str) -> bytes | None:
+    try:
+        with open(_path(name, key, ".bin"), "rb") as f:
+            data = f.read()
+    except OSError:
+        stats["misses"] += 1
+        return None
+    stats["hits"] += 1
+    return data
+
+def store_blob(name: str, key: str, data: bytes) -> None:
+    _write(_path(name, key, ".bin"), lambda f: f.write(data))
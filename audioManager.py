@@ -1,93 +1,262 @@
 import numpy as np
-import sounddevice as sd
-import matplotlib.pyplot as plt
+import time
+import wave as wavfile
+import argparse
+
+from consts import tunables
 
 FS = 44100
 CHANNELS = 1
 MUTE = False
 LOOP = False
 
+ATTACK = 0.1
+DECAY = 0.4
+ENVELOPE_DURATION = 2.0
+SILENT_AFTER = ATTACK + DECAY * np.log(1e4)  # Envelope is below -80 dB
+HARMONICS = (0.8, 0.3, 0.2)  # Gains of the 1st, 2nd and 3rd harmonic
+
+
+class Synth:
+    # Renders many voices at once. Each block is computed as voices x frames
+    # float32 matrices in preallocated buffers, VOICE_BLOCK voices at a time.
+    VOICE_BLOCK = 256
+
+    def __init__(self, max_frames: int = 1024, max_voices: int = VOICE_BLOCK):
+        self._allocate(max_frames, min(max_voices, self.VOICE_BLOCK))
+
+    def _allocate(self, frames: int, rows: int) -> None:
+        self.max_frames = frames
+        self.rows = rows
+        # float32 keeps the sin/cos on the vectorized path
+        self.ramp = (np.arange(frames) / FS).astype(np.float32)
+        self.decay = np.exp(-self.ramp / DECAY)
+        self.angle = np.empty((rows, frames), dtype=np.float32)
+        self.cos = np.empty((rows, frames), dtype=np.float32)
+        self.env = np.empty((rows, frames), dtype=np.float32)
+        self.partial = np.empty(frames, dtype=np.float32)
+        self.mix = np.empty(frames, dtype=np.float32)
+
+    def render(self, frames: int, frequency: np.ndarray, amplitude: np.ndarray, time_offset: np.ndarray, phase: np.ndarray) -> np.ndarray:
+        # Mixes all voices into self.mix[:frames] and advances time_offset and
+        # phase (in cycles) in place. Phase runs independently of the envelope
+        # so frequency changes and envelope restarts do not click.
+        audible = (frequency > 0) & (amplitude > 0)
+        if not LOOP:
+            audible &= time_offset < SILENT_AFTER
+        voices = np.flatnonzero(audible)
+
+        rows = min(max(len(voices), self.rows), self.VOICE_BLOCK)
+        if frames > self.max_frames or rows > self.rows:
+            self._allocate(max(frames, self.max_frames), rows)
+        mix = self.mix[:frames]
+        mix[:] = 0
+
+        for start in range(0, len(voices), self.rows):
+            v = voices[start:start + self.rows]
+            self._render_block(frames, frequency[v], amplitude[v], time_offset[v], phase[v])
+
+        time_offset += frames / FS
+        phase += frequency * (frames / FS)
+        phase %= 1.0
+        return mix
+
+    def _render_block(self, frames, f, a, offset, phase) -> None:
+        n = len(f)
+        ramp = self.ramp[:frames]
+        angle = self.angle[:n, :frames]
+        cos = self.cos[:n, :frames]
+        env = self.env[:n, :frames]
+
+        # sin(2x) = 2 sin(x) cos(x), sin(3x) = sin(x) (3 - 4 sin(x)^2)
+        h2 = np.where(f * 2 < FS / 2, HARMONICS[1] * 2, 0.0).astype(np.float32)[:, None]
+        h3 = np.where(f * 3 < FS / 2, HARMONICS[2], 0.0).astype(np.float32)[:, None]
+        np.multiply.outer(f.astype(np.float32), ramp, out=angle)
+        angle += phase.astype(np.float32)[:, None]
+        angle *= 2 * np.pi
+        np.cos(angle, out=cos)
+        np.sin(angle, out=angle)
+        cos *= h2
+        wave = env
+        np.multiply(angle, angle, out=wave)
+        wave *= -4
+        wave += 3
+        wave *= h3
+        wave += cos
+        wave += HARMONICS[0]
+        wave *= angle
+
+        # Attack ramp then exponential decay: the smaller of the two curves.
+        # Without looping the decay factors into voice and frame terms.
+        t = np.add.outer(offset.astype(np.float32), ramp, out=angle)
+        if LOOP:
+            t %= ENVELOPE_DURATION
+            np.subtract(t, ATTACK, out=cos)
+            cos *= -1 / DECAY
+            np.exp(cos, out=cos)
+        else:
+            decay = np.exp((ATTACK - offset) / DECAY).astype(np.float32)
+            np.multiply.outer(decay, self.decay[:frames], out=cos)
+        t /= ATTACK
+        np.minimum(t, cos, out=cos)
+        wave *= cos
+
+        np.dot(a.astype(np.float32), wave, out=self.partial[:frames])
+        self.mix[:frames] += self.partial[:frames]
+
 
 class Wave:
     def __init__(self, frequency=440.0, amplitude=0.5):
         self.frequency = frequency
         self.amplitude = amplitude
         self.time_offset = 0.0  # total playback time
-    
-
+        self.phase = 0.0  # oscillator position in cycles
 
     def create_wave(self, frames):
-
-        # Envelope duration in seconds
-        envelope_duration = 2.0
-
-        # Create local time array within envelope cycle
-        t = (np.arange(frames) / FS + self.time_offset)
-        if LOOP:
-            t = t % envelope_duration
-
-        # Update time offset
-        self.time_offset += frames / FS
-
-        # Base wave
-        f = self.frequency
-        wave = 0.8 * np.sin(2 * np.pi * f * t)
-        if f * 2 < FS / 2:
-            wave += 0.3 * np.sin(2 * np.pi * f * 2 * t)
-        if f * 3 < FS / 2:
-            wave += 0.2 * np.sin(2 * np.pi * f * 3 * t)
-
-        # Envelope (looped)
-        attack = 0.1
-        decay = 0.4
-        env = np.ones_like(t)
-        env[t < attack] = t[t < attack] / attack
-        env[t >= attack] = np.exp(-(t[t >= attack] - attack) / decay)
-
-        wave *= env
-        return (self.amplitude * wave).reshape(-1, 1)
+        frequency = np.array([self.frequency], dtype=float)
+        amplitude = np.array([self.amplitude], dtype=float)
+        time_offset = np.array([self.time_offset])
+        phase = np.array([self.phase])
+        wave = Synth(frames, 1).render(frames, frequency, amplitude, time_offset, phase)
+        self.time_offset = float(time_offset[0])
+        self.phase = float(phase[0])
+        return wave.reshape(-1, 1)
     
     def __repr__(self):
         return f"Wave(frequency={self.frequency}, amplitude={self.amplitude})"
 
 
+class VoiceBuffer:
+    def __init__(self, capacity: int):
+        self.seq = 0
+        self.count = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.frequency = np.zeros(capacity)
+        self.amplitude = np.zeros(capacity)
+        self.onset = np.zeros(capacity)  # time.time() of the last envelope restart
+
+    @property
+    def capacity(self) -> int:
+        return len(self.ids)
+
+
+class VoiceBoard:
+    # Double-buffered voice parameters handed from the simulation to the audio
+    # callback. The writer fills the back buffer and then flips front; the
+    # reader copies out of front and retries if a write overtook it. Neither
+    # side takes a lock or touches simulation objects.
+    def __init__(self, capacity: int):
+        self.buffers = [VoiceBuffer(capacity), VoiceBuffer(capacity)]
+        self.front = self.buffers[0]
+        self.seq = 0
+
+    def publish(self, ids, frequency, amplitude, onset) -> None:
+        n = len(ids)
+        back = 1 if self.front is self.buffers[0] else 0
+        if n > self.buffers[back].capacity:
+            self.buffers[back] = VoiceBuffer(max(n, 2 * self.buffers[back].capacity))
+        buffer = self.buffers[back]
+        buffer.seq = -1
+        buffer.ids[:n] = ids
+        buffer.frequency[:n] = frequency
+        buffer.amplitude[:n] = amplitude
+        buffer.onset[:n] = onset
+        buffer.count = n
+        self.seq += 1
+        buffer.seq = self.seq
+        self.front = buffer
+
+    def read(self, out: VoiceBuffer) -> VoiceBuffer:
+        while True:
+            buffer = self.front
+            seq = buffer.seq
+            n = buffer.count
+            if n > out.capacity:
+                out = VoiceBuffer(max(n, 2 * out.capacity))
+            out.ids[:n] = buffer.ids[:n]
+            out.frequency[:n] = buffer.frequency[:n]
+            out.amplitude[:n] = buffer.amplitude[:n]
+            out.onset[:n] = buffer.onset[:n]
+            if seq >= 0 and buffer.seq == seq:
+                out.seq = seq
+                out.count = n
+                return out
+
+
 class AudioManager:
-    def __init__(self, bodies):
-        self.phase = 0.0
-        self.stream = sd.OutputStream(samplerate=FS, channels=CHANNELS, callback=self.callback)
-        self.bodies = bodies
+    # headless skips the sounddevice stream so callback can be driven directly,
+    # e.g. on a machine without audio hardware; clock supplies callback time
+    def __init__(self, voices: VoiceBoard, headless: bool = False, clock=time.time):
+        self.stream = None
+        if not headless:
+            import sounddevice as sd
+            self.stream = sd.OutputStream(samplerate=FS, channels=CHANNELS, callback=self.callback)
+        self.clock = clock
+        self.voices = voices
+        self.current = VoiceBuffer(voices.front.capacity)
+        self.synth = Synth()
+        # Oscillator phases of the voices rendered last block, keyed by id
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.phase = np.zeros(0)
+
+    def _carry_phase(self, ids: np.ndarray) -> np.ndarray:
+        if len(self.ids) == 0:
+            return np.zeros(len(ids))
+        order = np.argsort(self.ids)
+        known = self.ids[order]
+        at = np.minimum(np.searchsorted(known, ids), len(known) - 1)
+        return np.where(known[at] == ids, self.phase[order][at], 0.0)
+
+    def render(self, frames: int, now: float) -> np.ndarray:
+        self.current = self.voices.read(self.current)
+        n = self.current.count
+        ids = self.current.ids[:n]
+        phase = self._carry_phase(ids)
+        time_offset = now - self.current.onset[:n]
+
+        # Over the voice limit only the loudest sounding voices are rendered
+        amplitude = self.current.amplitude[:n]
+        limit = tunables.max_voices
+        if n > limit:
+            loudness = amplitude if LOOP else np.where(time_offset < SILENT_AFTER, amplitude, 0)
+            amplitude = amplitude.copy()
+            amplitude[np.argpartition(loudness, n - limit)[:n - limit]] = 0
 
+        data = self.synth.render(frames, self.current.frequency[:n], amplitude, time_offset, phase)
+        self.ids = ids.copy()
+        self.phase = phase
+        return data
 
-    def callback(self, outdata, frames, time, status):
+    def callback(self, outdata, frames, time_info, status):
         if status:
             print(status)
 
-        data = np.zeros((frames, 1))
-        for body in self.bodies:
-            data += body.wave.create_wave(frames)
+        data = self.render(frames, self.clock())
 
-        max_val = np.max(np.abs(data))
+        max_val = np.max(np.abs(data), initial=0)
         if max_val > 1.0:
             data /= max_val
 
-        outdata[:] = data
+        outdata[:, 0] = data
     
     def start(self):
-        if MUTE:
+        if MUTE or self.stream is None:
             print("Audio is muted.")
             return
         self.stream.start()
     
     def stop(self):
+        if self.stream is None:
+            return
         self.stream.stop()
         self.stream.close()
 
     def plot_waveform(self, duration=2):
+        import matplotlib.pyplot as plt
+
         frames = int(FS * duration)
         t = np.arange(frames) / FS
-        data = np.zeros((frames, 1))
-        for body in self.bodies:
-            data += body.wave.create_wave(frames)
+        data = self.render(frames, time.time())
 
         plt.plot(t, data)
         plt.title("Synth Waveform")
@@ -96,23 +265,110 @@ class AudioManager:
         plt.grid(True)
         plt.show(block=False)
 
-class Obj:
-    def __init__(self, wave: Wave):
-        self.wave = wave
-        pass
+class ScriptedVoices:
+    # Deterministic stand-in for the simulation: count voices on snapped notes,
+    # each retriggering every period seconds at a staggered offset
+    def __init__(self, count: int, period: float = 2.0, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.ids = np.arange(count, dtype=np.int64)
+        self.frequency = 440.0 * 2 ** (rng.integers(-24, 25, count) / 12)
+        self.amplitude = rng.uniform(1, 30, count) * 0.003
+        self.stagger = rng.uniform(0, period, count)
+        self.period = period
+
+    def publish(self, voices: VoiceBoard, now: float) -> None:
+        onset = now - (now + self.stagger) % self.period
+        voices.publish(self.ids, self.frequency, self.amplitude, onset)
+
+
+def render_offline(path: str, count: int = 64, seconds: float = 10, block: int = 512) -> np.ndarray:
+    # Runs callback against a virtual clock and writes the result as 16-bit WAV
+    script = ScriptedVoices(count)
+    voices = VoiceBoard(count)
+    clock = [0.0]
+    manager = AudioManager(voices, headless=True, clock=lambda: clock[0])
+
+    blocks = int(np.ceil(seconds * FS / block))
+    out = np.zeros((blocks * block, CHANNELS), dtype=np.float32)
+    for i in range(blocks):
+        script.publish(voices, clock[0])
+        manager.callback(out[i * block:(i + 1) * block], block, None, None)
+        clock[0] += block / FS
+
+    out = out[:int(seconds * FS)]
+    with wavfile.open(path, "wb") as f:
+        f.setnchannels(CHANNELS)
+        f.setsampwidth(2)
+        f.setframerate(FS)
+        f.writeframes((np.clip(out, -1, 1) * 32767).astype("<i2").tobytes())
+    return out
+
+
+def benchmark_callback(voice_counts=(16, 128, 512, 2048), block_sizes=(256, 512, 1024), seconds: float = 2) -> list[dict]:
+    # Times callback per block against the block's real-time budget
+    results = []
+    for count in voice_counts:
+        for block in block_sizes:
+            script = ScriptedVoices(count, period=0.5)
+            voices = VoiceBoard(count)
+            clock = [0.0]
+            manager = AudioManager(voices, headless=True, clock=lambda: clock[0])
+            outdata = np.zeros((block, CHANNELS), dtype=np.float32)
+
+            times = []
+            for _ in range(max(1, int(seconds * FS / block))):
+                script.publish(voices, clock[0])
+                start = time.perf_counter()
+                manager.callback(outdata, block, None, None)
+                times.append(time.perf_counter() - start)
+                clock[0] += block / FS
+
+            times = np.array(times)
+            budget = block / FS
+            results.append({
+                "voices": count,
+                "block": block,
+                "budget_ms": budget * 1000,
+                "mean_ms": times.mean() * 1000,
+                "p99_ms": np.percentile(times, 99) * 1000,
+                "max_ms": times.max() * 1000,
+                "load": times.mean() / budget,
+                "overruns": int((times > budget).sum()),
+            })
+    return results
+
 
 if __name__ == "__main__":
-    bodies = [
-        Obj(Wave(261.63, 0.3)),  # C4
-        # Obj(Wave(329.63, 0.3)),  # E4
-        # Obj(Wave(392.00, 0.3)),  # G4
+    parser = argparse.ArgumentParser(description="Synth demo, offline render and callback benchmark")
+    parser.add_argument("--render", metavar="WAV", help="render scripted voices to a WAV file instead of playing")
+    parser.add_argument("--voices", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--block", type=int, default=512)
+    parser.add_argument("--bench", action="store_true", help="time the callback at several voice counts and block sizes")
+    args = parser.parse_args()
+
+    if args.render:
+        render_offline(args.render, args.voices, args.seconds, args.block)
+        print(f"Wrote {args.seconds}s of {args.voices} voices to {args.render}")
+    if args.bench:
+        print(f"{'voices':>6} {'block':>6} {'budget':>8} {'mean':>8} {'p99':>8} {'max':>8} {'load':>6} {'over':>5}")
+        for r in benchmark_callback():
+            print(f"{r['voices']:>6} {r['block']:>6} {r['budget_ms']:>7.2f}ms {r['mean_ms']:>6.2f}ms {r['p99_ms']:>6.2f}ms {r['max_ms']:>6.2f}ms {r['load']:>6.0%} {r['overruns']:>5}")
+    if args.render or args.bench:
+        raise SystemExit
+
+    waves = [
+        Wave(261.63, 0.3),  # C4
+        # Wave(329.63, 0.3),  # E4
+        # Wave(392.00, 0.3),  # G4
     ]
 
-    auddioManager = AudioManager(bodies)
+    voices = VoiceBoard(len(waves))
+    voices.publish(np.arange(len(waves)), [wave.frequency for wave in waves], [wave.amplitude for wave in waves], np.full(len(waves), time.time()))
+
+    auddioManager = AudioManager(voices)
     auddioManager.plot_waveform()
 
     # Plot the waveform
     auddioManager.start()
     input("Press Enter to plot the waveform...")
-
-
@@ -0,0 +1,260 @@
+import argparse
+import json
+import platform
+import subprocess
+import time
+import numpy as np
+
+from pygame.math import Vector2
+from blob import Blob, Body
+from world import World, collide_world
+from collisions import candidate_pairs, broadphase_pairs
+from audioManager import AudioManager, CHANNELS
+from consts import *
+
+AUDIO_BLOCK = 512
+
+
+class NullRenderer:
+    # Stands in for CircleRenderer and PolygonBatch so the CPU side of drawing
+    # is timed without a GL context
+    def __init__(self):
+        self.count = 0
+
+    def begin(self) -> None:
+        self.count = 0
+
+    def add_many(self, centers, *rest) -> None:
+        self.count += len(centers)
+
+    def add(self, polygons, color) -> None:
+        self.count += polygons.shape[0] * polygons.shape[1]
+
+    def flush(self) -> None:
+        pass
+
+
+def build_scene(particles: int, blobs: int = 0, layout: str = "uniform", trails: bool = False, seed: int = 0, width: int = WIDTH, height: int = HEIGHT,
+                workers: int = 0, calm: bool = False, mixed: bool = False) -> World:
+    # uniform spreads bodies over the screen; clustered packs them into a few
+    # dense clumps. With trails every body moves fast enough to leave a full
+    # trail; without, they drift below the trail threshold. calm starts them
+    # at rest and simulates until the piles have settled and mostly sleep.
+    # mixed spreads radii over the whole range a particle spawns at and puts
+    # the hand mid-screen.
+    clock = [0.0]
+    # Scaling scenes go past MAX_PARTICLES, so lift the cap instead of evicting
+    world = World(width, height, clock=lambda: clock[0], seed=seed, max_particles=max(particles, MAX_PARTICLES),
+                  collision_workers=workers)
+    world.sim_clock = clock
+    rng = np.random.default_rng(seed)
+
+    if layout == "uniform":
+        pos = rng.random((particles, 2)) * (width, height)
+    elif layout == "clustered":
+        centers = rng.random((8, 2)) * (width, height)
+        pos = centers[rng.integers(0, len(centers), particles)] + rng.normal(0, 40, (particles, 2))
+        pos = np.clip(pos, 0, (width, height))
+    else:
+        raise ValueError(f"unknown layout {layout!r}")
+    radius = mixed_radii(rng, particles) if mixed else rng.uniform(3, 12, particles)
+    if mixed:
+        world.rightHand.pos = Vector2(width / 2, height / 2)
+    speed = 0.0 if calm else 3.0 if trails else 0.5
+    angle = rng.random(particles) * 2 * np.pi
+    vel = np.stack([np.cos(angle), np.sin(angle)], axis=1) * speed
+
+    for i in range(particles):
+        Body(radius[i], Vector2(*pos[i]), colors[i % len(colors)], store=world.particles, spawn_time=0.0)
+    store = world.particles
+    store.ppos[:particles] = store.pos[:particles] - vel
+
+    if trails:
+        dt = MAX_TRAIL_AGE / TRAIL_SAMPLES
+        rows = np.arange(particles)
+        for k in range(TRAIL_SAMPLES, 0, -1):
+            store.trails.push(rows, store.pos[:particles] - vel * k, -k * dt)
+
+    for k in range(blobs):
+        origin = Vector2(*(rng.random(2) * (width, height)))
+        Blob(origin, 16, rng.uniform(100, 200), colors[k % len(colors)], store=world.blobs, spawn_time=0.0)
+
+    if calm:
+        for _ in range(10 * PHYSICS_HZ):
+            if store.asleep[:store.count].mean() > 0.95:
+                break
+            world.step(1 / PHYSICS_HZ)
+            clock[0] += 1 / PHYSICS_HZ
+        store.time[:store.count] = clock[0]  # Keep them from expiring mid-run
+    return world
+
+
+def mixed_radii(rng: np.random.Generator, count: int) -> np.ndarray:
+    # Mostly the small bodies of the other scenes, with a tenth spread
+    # log-uniformly up to the largest particle a wrist spawns before it makes
+    # a blob instead
+    radius = rng.uniform(3, 12, count)
+    large = rng.random(count) < 0.1
+    radius[large] = np.exp(rng.uniform(np.log(12), np.log(MAX_PARTICLE_RADIUS / 3), large.sum()))
+    return radius
+
+
+def timed_step(world: World, dt: float, renderer: NullRenderer, audio: AudioManager, outdata: np.ndarray, times: dict) -> None:
+    # World.step, World.draw and one audio block, with each stage timed
+    now = world.clock()
+    particles = world.particles
+    blobs = world.blobs
+    stages = [
+        ("save_state", lambda: (particles.save_state(), blobs.save_state())),
+        ("blobs.update", lambda: blobs.update(dt)),
+        ("blobs.constrain", lambda: blobs.constrain_to_bounds(world.width, world.height)),
+        ("collide", lambda: collide_world(particles, blobs, world.rightHand, now, world.solve)),
+        ("particles.expire", lambda: particles.expire(now, MAX_PARTICLE_AGE)),
+        ("particles.update", lambda: particles.update(dt, now=now)),
+        ("particles.constrain", lambda: particles.constrain_to_bounds(world.width, world.height)),
+        ("publish_voices", lambda: particles.publish_voices(world.voices)),
+        ("blobs.draw", lambda: blobs.draw(renderer)),
+        ("particles.draw", lambda: particles.draw(renderer, now)),
+        ("audio", lambda: audio.callback(outdata, AUDIO_BLOCK, None, None)),
+    ]
+    total = 0.0
+    for name, stage in stages:
+        start = time.perf_counter()
+        stage()
+        elapsed = time.perf_counter() - start
+        times.setdefault(name, []).append(elapsed)
+        total += elapsed
+    times.setdefault("frame", []).append(total)
+
+
+def run_scene(particles: int, blobs: int = 0, layout: str = "uniform", trails: bool = False, frames: int = 60, warmup: int = 5, seed: int = 0,
+              workers: int = 0, calm: bool = False, mixed: bool = False) -> list[dict]:
+    world = build_scene(particles, blobs, layout, trails, seed, workers=workers, calm=calm, mixed=mixed)
+    audio = AudioManager(world.voices, headless=True, clock=world.clock)
+    renderer = NullRenderer()
+    outdata = np.zeros((AUDIO_BLOCK, CHANNELS), dtype=np.float32)
+    dt = 1 / PHYSICS_HZ
+
+    times = {}
+    for frame in range(warmup + frames):
+        if frame == warmup:
+            times = {}
+        timed_step(world, dt, renderer, audio, outdata, times)
+        world.sim_clock[0] += dt
+    world.close()
+
+    scene = f"{layout}-{particles}p-{blobs}b" + ("-trails" if trails else "") + ("-calm" if calm else "") + ("-mixed" if mixed else "")
+    results = []
+    for stage, samples in times.items():
+        samples = np.array(samples) * 1000
+        results.append({
+            "scene": scene,
+            "layout": layout,
+            "particles": particles,
+            "blobs": blobs,
+            "trails": trails,
+            "calm": calm,
+            "mixed": mixed,
+            "stage": stage,
+            "mean_ms": float(samples.mean()),
+            "median_ms": float(np.median(samples)),
+            "p95_ms": float(np.percentile(samples, 95)),
+            "min_ms": float(samples.min()),
+        })
+    return results
+
+
+def scenarios(quick: bool = False) -> list[dict]:
+    # Particle scaling runs past MAX_PARTICLES on purpose
+    counts = [250, 1000, MAX_PARTICLES, MAX_PARTICLES * 2] if quick else [250, 500, 1000, 2000, MAX_PARTICLES, MAX_PARTICLES * 2, MAX_PARTICLES * 4]
+    scenes = [dict(particles=n) for n in counts]
+    scenes += [dict(particles=n, layout="clustered") for n in counts[1::2]]
+    scenes += [dict(particles=n, trails=True) for n in counts[1::2]]
+    scenes += [dict(particles=500, blobs=m) for m in ([4, 32] if quick else [4, 16, 64])]
+    scenes += [dict(particles=n, calm=True) for n in [1000, MAX_PARTICLES]]
+    scenes += [dict(particles=n, mixed=True) for n in counts[1::2]]
+    return scenes
+
+
+def broadphase(counts: list[int], repeats: int = 20, seed: int = 0) -> list[dict]:
+    # Candidate pairs, contacts found and time for the broadphase against a
+    # single grid of CELL_SIZE, which misses contacts between large bodies,
+    # and a single grid wide enough for the largest, which misses none
+    rng = np.random.default_rng(seed)
+    results = []
+    for n in counts:
+        pos = rng.random((n, 2)) * (WIDTH, HEIGHT)
+        radius = mixed_radii(rng, n)
+        methods = [("grid", lambda: candidate_pairs(pos)),
+                   ("coarse_grid", lambda: candidate_pairs(pos, 2 * radius.max())),
+                   ("hierarchical", lambda: broadphase_pairs(pos, radius))]
+        for name, method in methods:
+            samples = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                a, b = method()
+                samples.append(time.perf_counter() - start)
+            dist_sq = ((pos[a] - pos[b]) ** 2).sum(axis=1)
+            contacts = int((dist_sq < (radius[a] + radius[b]) ** 2).sum())
+            results.append({"bodies": n, "method": name, "candidates": len(a), "contacts": contacts,
+                            "median_ms": float(np.median(samples) * 1000)})
+    return results
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+def compare(baseline: dict, current: dict, stage: str = "frame") -> None:
+    # Ratio of medians per scene; below 1 means current is faster
+    old = {(r["scene"], r["stage"]): r["median_ms"] for r in baseline["results"]}
+    print(f"{'scene':<28} {'stage':<20} {'base':>9} {'now':>9} {'ratio':>6}")
+    for r in current["results"]:
+        key = (r["scene"], r["stage"])
+        if key in old and (stage is None or r["stage"] == stage):
+            print(f"{r['scene']:<28} {r['stage']:<20} {old[key]:>7.3f}ms {r['median_ms']:>7.3f}ms {r['median_ms'] / old[key]:>6.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time each simulation stage on synthetic scenes")
+    parser.add_argument("--out", metavar="JSON", help="write results to a file")
+    parser.add_argument("--compare", metavar="JSON", help="compare against an earlier --out file")
+    parser.add_argument("--all-stages", action="store_true", help="compare every stage, not just the frame total")
+    parser.add_argument("--quick", action="store_true", help="fewer, smaller scenes")
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=0, help="collision worker processes, as World's collision_workers")
+    parser.add_argument("--broadphase", action="store_true", help="compare broadphases on mixed-size bodies instead")
+    args = parser.parse_args()
+
+    if args.broadphase:
+        counts = [1000, MAX_PARTICLES] if args.quick else [250, 1000, MAX_PARTICLES, MAX_PARTICLES * 4]
+        print(f"{'bodies':>7} {'method':<13} {'candidates':>10} {'contacts':>9} {'time':>10}")
+        for r in broadphase(counts):
+            print(f"{r['bodies']:>7} {r['method']:<13} {r['candidates']:>10} {r['contacts']:>9} {r['median_ms']:>8.3f}ms")
+        raise SystemExit
+
+    report = {"meta": {**metadata(), "workers": args.workers}, "results": []}
+    for scene in scenarios(args.quick):
+        results = run_scene(frames=args.frames, workers=args.workers, **scene)
+        report["results"] += results
+        frame = next(r for r in results if r["stage"] == "frame")
+        slowest = max((r for r in results if r["stage"] != "frame"), key=lambda r: r["median_ms"])
+        print(f"{frame['scene']:<28} {frame['median_ms']:>8.3f}ms/frame  slowest: {slowest['stage']} {slowest['median_ms']:.3f}ms")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report, None if args.all_stages else "frame")
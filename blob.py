@@ -1,231 +1,283 @@
 from pygame.math import Vector2
-from math import cos, sin, pi
+from math import pi
 from OpenGL.GL import *
-from utils import draw_catmull_rom, drawCircle, rgb255, snap_to_note
-from collections import deque
+from utils import catmull_rom_loops, segments_for_radius, drawCircle, PolygonBatch
+import numpy as np
 import time
-from audioManager import Wave
-from shaders import draw_circle_shader
 from consts import *
+from particles import ParticleStore, bounce_off_walls
+
+
+class BlobStore:
+    # Points of every live blob in one array, blob after blob. Each blob owns
+    # the range [start, start + size); nxt and prv give every point's ring
+    # neighbours so the solver can work on all blobs at once.
+    def __init__(self):
+        self.blobs = []  # Blob views, blobs[k].index == k
+        self.colors: list[tuple[float, float, float]] = []
+        self.pos = np.zeros((0, 2))
+        self.ppos = np.zeros((0, 2))
+        self.last = np.zeros((0, 2))
+        self.acc = np.zeros((0, 2))
+        self.size = np.zeros(0, dtype=np.int64)
+        self.radius = np.zeros(0)
+        self.cordLen = np.zeros(0)
+        self.area = np.zeros(0)
+        self.time = np.zeros(0)
+        self._reindex()
+
+    def __len__(self) -> int:
+        return len(self.blobs)
+
+    def __iter__(self):
+        return iter(self.blobs)
+
+    def _reindex(self) -> None:
+        self.start = np.cumsum(self.size) - self.size
+        self.owner = np.repeat(np.arange(len(self.size)), self.size)
+        local = np.arange(len(self.pos)) - self.start[self.owner]
+        size = self.size[self.owner]
+        self.nxt = self.start[self.owner] + (local + 1) % size
+        self.prv = self.start[self.owner] + (local - 1) % size
+        for k, blob in enumerate(self.blobs):
+            blob.index = k
+
+    def add(self, blob, origin: Vector2, numPoints: int, radius: float, color: tuple[float, float, float], spawn_time: float) -> None:
+        angle = 2 * pi * np.arange(numPoints) / numPoints
+        points = np.stack([origin.x + np.cos(angle) * radius, origin.y + np.sin(angle) * radius], axis=1)
+        self.pos = np.concatenate([self.pos, points])
+        self.ppos = np.concatenate([self.ppos, points])
+        self.last = np.concatenate([self.last, points])
+        self.acc = np.concatenate([self.acc, np.zeros_like(points)])
+        self.size = np.append(self.size, numPoints)
+        self.radius = np.append(self.radius, radius)
+        self.cordLen = np.append(self.cordLen, (radius * pi * 2)/numPoints)
+        self.area = np.append(self.area, radius ** 2 * pi)
+        self.time = np.append(self.time, spawn_time)
+        self.colors.append(color)
+        self.blobs.append(blob)
+        self._reindex()
+
+    def remove(self, indices) -> None:
+        keep = np.ones(len(self.blobs), dtype=bool)
+        keep[indices] = False
+        points = keep[self.owner]
+        for name in ("pos", "ppos", "last", "acc"):
+            setattr(self, name, getattr(self, name)[points])
+        for name in ("size", "radius", "cordLen", "area", "time"):
+            setattr(self, name, getattr(self, name)[keep])
+        self.colors = [color for color, k in zip(self.colors, keep) if k]
+        self.blobs = [blob for blob, k in zip(self.blobs, keep) if k]
+        self._reindex()
+
+    def expired(self, now: float, max_age: float) -> np.ndarray:
+        return np.flatnonzero(now - self.time > max_age)
+
+    def points_of(self, k: int) -> slice:
+        return slice(int(self.start[k]), int(self.start[k] + self.size[k]))
+
+    def getArea(self) -> np.ndarray:
+        # Shoelace formula, summed per blob
+        pos, nxt = self.pos, self.pos[self.nxt]
+        terms = (pos[:, 0] - nxt[:, 0]) * (pos[:, 1] + nxt[:, 1]) / 2
+        return np.bincount(self.owner, terms, minlength=len(self.size))
+
+    def save_state(self) -> None:
+        self.last[:] = self.pos
+
+    def update(self, dt: float) -> None:
+        if len(self.pos) == 0:
+            return
+        pos = self.pos
+        owner = self.owner
+
+        # Chord springs pull each point towards its next neighbour when stretched
+        delta = pos[self.nxt] - pos
+        dist = np.hypot(delta[:, 0], delta[:, 1])
+        cordLen = self.cordLen[owner]
+        stretched = dist > cordLen
+        pull = np.zeros_like(delta)
+        pull[stretched] = delta[stretched] / dist[stretched, None] * ((dist[stretched] - cordLen[stretched]) / 2)[:, None]
+        self.acc += pull
+        self.acc -= pull[self.prv]
+
+        # Push along the outward normal to restore each blob's rest area
+        areaError = (self.area - self.getArea()) / (self.radius * pi * 2)
+        secant = pos[self.nxt] - pos[self.prv]
+        length = np.hypot(secant[:, 0], secant[:, 1])
+        secant[length > 0] /= length[length > 0, None]
+        self.acc[:, 0] += secant[:, 1] * areaError[owner]
+        self.acc[:, 1] -= secant[:, 0] * areaError[owner]
+
+        # Blob forces act every step, so they scale with the step length
+        steps = dt * REFERENCE_HZ
+        vel = (pos - self.ppos) * (1-FRICTION) ** steps
+        self.ppos[:] = pos
+        pos += vel
+        pos += self.acc * dt * steps
+        self.acc[:] = 0
+
+    def constrain_to_bounds(self, width: int, height: int, bounce: float = 1) -> None:
+        bounce_off_walls(self.pos, self.ppos, 0, width, height, bounce)
+
+    def draw(self, batch: PolygonBatch, alpha: float = 1.0, blobs=None) -> None:
+        # Outlines of the same point count and segment count are tessellated
+        # together, then queued in blob order so overlaps stack as before
+        points = self.last + (self.pos - self.last) * alpha
+        blobs = range(len(self.blobs)) if blobs is None else blobs
+        groups = {}
+        for k in blobs:
+            key = (int(self.size[k]), segments_for_radius(self.radius[k], int(self.size[k]), tunables.spline_segments))
+            groups.setdefault(key, []).append(k)
+
+        outlines = {}
+        for (size, segments), members in groups.items():
+            index = self.start[members][:, None] + np.arange(size)
+            for k, outline in zip(members, catmull_rom_loops(points[index], segments)):
+                outlines[k] = outline
+
+        for k in blobs:
+            batch.add(outlines[k][None], (*self.colors[k], 1))
+        batch.flush()
 
 
 class Blob:
-    def __init__(self, origin: Vector2, numPoints: int, radius: float, color: tuple[float, float, float]):
+    # Thin view over one blob of a BlobStore; standalone blobs get a private
+    # store.
+    def __init__(self, origin: Vector2, numPoints: int, radius: float, color: tuple[float, float, float], store: BlobStore = None, spawn_time: float = None):
+        self.store = store if store is not None else BlobStore()
         self.origin = origin
-        self.radius = radius
-        self.color = color
-        self.time = time.time()
-        self.points: list[BlobPoint] = []
-        self.cordLen = (radius * pi * 2)/numPoints
-        self.area = radius ** 2 * pi
-        for i in range(numPoints):
-            self.points.append(BlobPoint(Vector2(origin.x + cos(2*pi * i / numPoints)*radius, origin.y + sin(2*pi * i/ numPoints) * radius)))
-    
-    def update(self, dt: float) -> None:
-        
-        for i in range(len(self.points)):
-            cur = self.points[i]
-            next = self.points[(i + 1) % len(self.points)]
-            if(cur.pos.distance_to(next.pos) > self.cordLen):
-                midPoint = (cur.pos + next.pos) / 2
-                temp = (midPoint - cur.pos)
-                if temp.magnitude() > 0:
-                    acc = temp.normalize() * (cur.pos.distance_to(next.pos)-self.cordLen) / 2
-                    cur.acc += acc 
-                    next.acc -= acc
-        
-        areaError = (self.area - self.getArea()) / (self.radius * pi * 2)
-        for i in range(len(self.points)):
-            prev = self.points[(i - 1) % len(self.points)]
-            cur = self.points[i]
-            next = self.points[(i + 1) % len(self.points)]
-            secant = (next.pos - prev.pos)
-            if secant.magnitude():
-                secant = secant.normalize()
-            normal = Vector2(secant.y, -secant.x) * areaError
-            cur.acc += normal
+        self.index = 0
+        self.store.add(self, origin, numPoints, radius, color, time.time() if spawn_time is None else spawn_time)
+
+    @property
+    def radius(self) -> float:
+        return float(self.store.radius[self.index])
+
+    @property
+    def color(self) -> tuple[float, float, float]:
+        return self.store.colors[self.index]
+
+    @property
+    def time(self) -> float:
+        return float(self.store.time[self.index])
 
-        for point in self.points:
-            point.update(dt)
+    @property
+    def cordLen(self) -> float:
+        return float(self.store.cordLen[self.index])
 
+    @property
+    def area(self) -> float:
+        return float(self.store.area[self.index])
+
+    @property
+    def points(self) -> list["BlobPoint"]:
+        span = self.store.points_of(self.index)
+        return [BlobPoint(self.store, i) for i in range(span.start, span.stop)]
 
     def getArea(self):
-        area = 0
-        for i in range(len(self.points)):
-            cur = self.points[i].pos
-            next = self.points[(i+1) % len(self.points)].pos
-            area += ((cur.x - next.x) * (cur.y + next.y) / 2);
-        return area
-    
-    def draw(self) -> None:
-        glUseProgram(0)
-        glColor4f(*self.color, 1)  # Bright red, fully opaque for visibility
-        draw_catmull_rom([point.pos for point in self.points], segments=20, loop=True)
+        return float(self.store.getArea()[self.index])
+
+    def draw(self, batch: PolygonBatch, alpha: float = 1.0) -> None:
+        self.store.draw(batch, alpha, [self.index])
 
 class BlobPoint:
-    def __init__(self, pos: Vector2):
-        self.radius = 0
-        self.pos: Vector2 = pos
-        self.ppos: Vector2 = pos.copy()
-        self.acc: Vector2 = Vector2(0, 0)
-        self.imune = False
+    # Thin view over one point of a BlobStore
+    radius = 0
+    imune = False
 
-    def constrain_to_bounds(self, width: int, height: int, bounce: float = 1):
-        vel = self.pos - self.ppos
-
-        # Left
-        if self.pos.x - self.radius < 0:
-            self.pos.x = self.radius
-            self.ppos.x = self.pos.x + vel.x * bounce
-
-        # Right
-        if self.pos.x + self.radius > width:
-            self.pos.x = width - self.radius
-            self.ppos.x = self.pos.x + vel.x * bounce
-
-        # Top
-        if self.pos.y - self.radius < 0:
-            self.pos.y = self.radius
-            self.ppos.y = self.pos.y + vel.y * bounce
-
-        # Bottom
-        if self.pos.y + self.radius > height:
-            self.pos.y = height - self.radius
-            self.ppos.y = self.pos.y + vel.y * bounce
-    
-    def update(self, dt: float) -> None:
-        temp = self.pos.copy()
-        vel = (self.pos -  self.ppos) * (1-FRICTION)
-        self.pos += vel
-        self.ppos = temp;
-        self.pos += self.acc * dt
-        self.acc = Vector2(0, 0)
+    def __init__(self, store: BlobStore, index: int):
+        self.store = store
+        self.index = index
+
+    @property
+    def pos(self) -> Vector2:
+        return Vector2(*self.store.pos[self.index])
+
+    @pos.setter
+    def pos(self, value) -> None:
+        self.store.pos[self.index] = value
+
+    @property
+    def ppos(self) -> Vector2:
+        return Vector2(*self.store.ppos[self.index])
+
+    @property
+    def acc(self) -> Vector2:
+        return Vector2(*self.store.acc[self.index])
 
+    @acc.setter
+    def acc(self, value) -> None:
+        self.store.acc[self.index] = value
 
     def __str__(self):
         return str(self.pos.x) + " " + str(self.pos.y)
 
 class Body:
-    def __init__(self, radius: float, pos:  Vector2, color: tuple[float, float, float], imune: bool = False):
-        self.radius = radius
-        self.pos = pos
-        self.ppos = pos
-        self.acc = Vector2(0, 0)
+    # Thin view over one slot of a ParticleStore; standalone bodies get a
+    # private single-slot store.
+    def __init__(self, radius: float, pos:  Vector2, color: tuple[float, float, float], imune: bool = False, store: ParticleStore = None, spawn_time: float = None):
+        self.store = store if store is not None else ParticleStore(1)
+        self.index = self.store.add(self, radius, pos, color, imune, time.time() if spawn_time is None else spawn_time)
 
-class BlobPoint:
-    def __init__(self, pos: Vector2):
-        self.radius = 0
-        self.pos: Vector2 = pos
-        self.ppos: Vector2 = pos.copy()
-        self.acc: Vector2 = Vector2(0, 0)
-        self.imune = False
-        self.wave = Wave(0, 0)
+    @property
+    def pos(self) -> Vector2:
+        return Vector2(*self.store.pos[self.index])
 
-    def constrain_to_bounds(self, width: int, height: int, bounce: float = 1):
-        vel = self.pos - self.ppos
-
-        # Left
-        if self.pos.x - self.radius < 0:
-            self.pos.x = self.radius
-            self.ppos.x = self.pos.x + vel.x * bounce
-
-        # Right
-        if self.pos.x + self.radius > width:
-            self.pos.x = width - self.radius
-            self.ppos.x = self.pos.x + vel.x * bounce
-
-        # Top
-        if self.pos.y - self.radius < 0:
-            self.pos.y = self.radius
-            self.ppos.y = self.pos.y + vel.y * bounce
-
-        # Bottom
-        if self.pos.y + self.radius > height:
-            self.pos.y = height - self.radius
-            self.ppos.y = self.pos.y + vel.y * bounce
-    
-    def update(self, dt: float) -> None:
-        temp = self.pos.copy()
-        vel = (self.pos -  self.ppos) * (1-FRICTION)
-        self.pos += vel
-        self.ppos = temp;
-        self.pos += self.acc * dt
-        self.acc = Vector2(0, 0)
+    @pos.setter
+    def pos(self, value) -> None:
+        self.store.pos[self.index] = value
 
+    @property
+    def ppos(self) -> Vector2:
+        return Vector2(*self.store.ppos[self.index])
 
-    def __str__(self):
-        return str(self.pos.x) + " " + str(self.pos.y)
+    @ppos.setter
+    def ppos(self, value) -> None:
+        self.store.ppos[self.index] = value
 
-class Body:
-    def __init__(self, radius: float, pos:  Vector2, color: tuple[float, float, float], imune: bool = False):
-        self.radius = radius
-        self.pos = pos
-        self.ppos = pos
-        self.acc = Vector2(0, 0)
-        self.trail = deque()
-        self.time = time.time()
-        self.color = color
-        self.imune = imune
-        self.wave = Wave(0, radius * AREA_SCALE)
+    @property
+    def acc(self) -> Vector2:
+        return Vector2(*self.store.acc[self.index])
+
+    @acc.setter
+    def acc(self, value) -> None:
+        self.store.acc[self.index] = value
+
+    @property
+    def radius(self) -> float:
+        return float(self.store.radius[self.index])
 
+    @radius.setter
+    def radius(self, value: float) -> None:
+        self.store.radius[self.index] = value
+
+    @property
+    def color(self) -> tuple[float, float, float]:
+        return self.store.palette[self.store.color_index[self.index]]
+
+    @color.setter
+    def color(self, value: tuple[float, float, float]) -> None:
+        self.store.color_index[self.index] = self.store.color_id(value)
+
+    @property
+    def time(self) -> float:
+        return float(self.store.time[self.index])
+
+    @property
+    def imune(self) -> bool:
+        return bool(self.store.imune[self.index])
 
     def constrain_to_bounds(self, width: int, height: int, bounce: float = 1):
-        vel = self.pos - self.ppos
-
-        # Left
-        if self.pos.x - self.radius < 0:
-            self.pos.x = self.radius
-            self.ppos.x = self.pos.x + vel.x * bounce
-
-        # Right
-        if self.pos.x + self.radius > width:
-            self.pos.x = width - self.radius
-            self.ppos.x = self.pos.x + vel.x * bounce
-
-        # Top
-        if self.pos.y - self.radius < 0:
-            self.pos.y = self.radius
-            self.ppos.y = self.pos.y + vel.y * bounce
-
-        # Bottom
-        if self.pos.y + self.radius > height:
-            self.pos.y = height - self.radius
-            self.ppos.y = self.pos.y + vel.y * bounce
-    
+        self.store.constrain_to_bounds(width, height, bounce, slice(self.index, self.index + 1))
+
     def update(self, dt: float):
-        current_time = time.time()
-
-        temp = self.pos.copy()
-        vel = (self.pos - self.ppos) * (1 - FRICTION)
-        raw_freq = vel.magnitude() * 70
-        self.wave.frequency = snap_to_note(raw_freq)
-        self.pos += vel
-        self.ppos = temp
-        self.pos += self.acc * dt
-        self.acc = Vector2(0, 0)
-
-        if (self.pos - self.ppos).length_squared() > 1**2:
-            self.trail.append({
-                "pos": self.ppos.copy(),
-                "time": current_time
-            })
-
-        self.trail = deque([
-            p for p in self.trail if current_time - p["time"] < MAX_TRAIL_AGE
-        ])
-
-    def draw(self, shader, elapsedTime) -> None:
+        self.store.update(dt, slice(self.index, self.index + 1))
+
+    def draw(self, renderer) -> None:
         if self.imune:
             glUseProgram(0)
             glColor4f(*self.color, 0.1)
             drawCircle(self.pos, self.radius)
         else:
-            current_time = time.time()
-            for particle in self.trail:
-                age = current_time - particle["time"]
-                t = 1 - (age / MAX_TRAIL_AGE)
-                if t <= 0:
-                    continue
-                draw_circle_shader(shader, particle["pos"].x, HEIGHT - particle["pos"].y, self.radius*t, time.time() - self.time, self.color, (self.color[0] * 1., self.color[1] * 1., self.color[2] * 1.), (self.color[0]*0.75, self.color[1]*0.75, self.color[2]*0.75), t* (1-elapsedTime))
-            draw_circle_shader(shader, self.pos.x, HEIGHT - self.pos.y, self.radius, time.time() - self.time, self.color, (self.color[0] * 1., self.color[1] * 1., self.color[2] * 1.), (self.color[0]*0.75, self.color[1]*0.75, self.color[2]*.75), 1-elapsedTime)
-
+            self.store.draw(renderer, time.time(), sl=slice(self.index, self.index + 1))
@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+
+from consts import POSE_INFERENCE_HZ, POSE_INPUT_WIDTH, MAX_POSE_PREDICTION
+
+# MediaPipe pose landmark rows and the columns each row is stored with
+LEFT_SHOULDER = 11
+RIGHT_SHOULDER = 12
+LEFT_WRIST = 15
+RIGHT_WRIST = 16
+LEFT_HIP = 23
+X, Y, Z, VISIBILITY = range(4)
+
+NUM_LANDMARKS = 33
+
+# landmarks is a (33, 4) float32 array, or None when no pose was found.
+# timing is (read start, read end, inference end) in perf_counter time.
+PoseSample = namedtuple("PoseSample", ["seq", "timestamp", "landmarks", "timing"], defaults=(None,))
+
+# A recording is the magic followed by packed fixed-size records, so it can be
+# memory-mapped and a session cut short still reads up to its last full record
+RECORDING_MAGIC = b"P4POSE01"
+POSE_RECORD = np.dtype([("timestamp", "<f8"), ("found", "u1"), ("landmarks", "<f4", (NUM_LANDMARKS, 4))])
+
+
+class PoseRecorder:
+    def __init__(self, path: str):
+        self.file = open(path, "wb")
+        self.file.write(RECORDING_MAGIC)
+        self.record = np.zeros(1, dtype=POSE_RECORD)
+
+    def write(self, sample: PoseSample) -> None:
+        record = self.record[0]
+        record["timestamp"] = sample.timestamp
+        record["found"] = sample.landmarks is not None
+        record["landmarks"] = 0 if sample.landmarks is None else sample.landmarks
+        self.file.write(self.record.tobytes())
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def load_recording(path: str) -> np.ndarray:
+    with open(path, "rb") as f:
+        if f.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError(f"{path} is not a pose recording")
+    count = (os.path.getsize(path) - len(RECORDING_MAGIC)) // POSE_RECORD.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=POSE_RECORD)
+    return np.memmap(path, dtype=POSE_RECORD, mode="r", offset=len(RECORDING_MAGIC), shape=(count,))
+
+
+class LatestValue:
+    # Single-slot mailbox: the writer replaces the value, readers take whatever
+    # is newest. Rebinding one attribute is atomic in CPython, so neither side
+    # ever blocks on the other.
+    def __init__(self):
+        self._value = None
+
+    def publish(self, value) -> None:
+        self._value = value
+
+    def get(self):
+        return self._value
+
+
+def prediction_horizon(pose_hz: float) -> float:
+    # Long enough to bridge the gap to the next reading at the configured
+    # rate, with slack for a late one; 0 means every camera frame
+    return max(MAX_POSE_PREDICTION, 1.5 / pose_hz) if pose_hz > 0 else MAX_POSE_PREDICTION
+
+
+class LandmarkFilter:
+    # Constant-velocity alpha-beta filter over every landmark, keyed on sample
+    # timestamps: update() blends each new reading into the tracked position
+    # and velocity, predict() extrapolates to any later time. That keeps the
+    # pose moving smoothly between readings when inference runs well below
+    # the render rate. Visibility is passed through from the last reading.
+    def __init__(self, alpha: float = 0.6, beta: float = 0.2, horizon: float = MAX_POSE_PREDICTION):
+        self.alpha = alpha
+        self.beta = beta
+        self.horizon = horizon  # Predictions hold after this many seconds without a reading
+        self.reset()
+
+    def reset(self) -> None:
+        self.value = None
+        self.velocity = None  # Normalized units per second
+        self.visibility = None
+        self.time = None
+
+    def update(self, landmarks: np.ndarray | None, timestamp: float) -> None:
+        if landmarks is None:
+            self.reset()
+            return
+        if self.value is None:
+            self.value = landmarks[:, :VISIBILITY].astype(np.float64)
+            self.velocity = np.zeros_like(self.value)
+        else:
+            dt = timestamp - self.time
+            if dt <= 0:
+                return
+            predicted = self.value + self.velocity * dt
+            residual = landmarks[:, :VISIBILITY] - predicted
+            self.value = predicted + self.alpha * residual
+            self.velocity = self.velocity + (self.beta / dt) * residual
+        self.visibility = landmarks[:, VISIBILITY].copy()
+        self.time = timestamp
+
+    def stale(self, now: float) -> bool:
+        # Past the horizon predictions hold still, so the velocity is stale
+        return self.time is None or now - self.time > self.horizon
+
+    def predict(self, now: float) -> np.ndarray | None:
+        if self.value is None:
+            return None
+        ahead = min(max(now - self.time, 0.0), self.horizon)
+        landmarks = np.empty((NUM_LANDMARKS, 4), dtype=np.float32)
+        landmarks[:, :VISIBILITY] = self.value + self.velocity * ahead
+        landmarks[:, VISIBILITY] = self.visibility
+        return landmarks
+
+
+class PoseWorker(threading.Thread):
+    # Reads the camera and runs pose estimation off the render thread,
+    # publishing every result to self.latest and optionally to a recording.
+    # Inference runs at most inference_hz times a second on frames scaled
+    # down to input_width; frames read in between are dropped.
+    def __init__(self, camera_index: int = 1, record_path: str = None,
+                 inference_hz: float = POSE_INFERENCE_HZ, input_width: int = POSE_INPUT_WIDTH):
+        super().__init__(name="pose-worker", daemon=True)
+        self.camera_index = camera_index
+        self.record_path = record_path
+        self.inference_interval = 1 / inference_hz if inference_hz > 0 else 0.0
+        self.input_width = input_width
+        self.latest = LatestValue()
+        self.stopping = threading.Event()
+
+    def run(self) -> None:
+        import cv2
+        import mediapipe as mp
+
+        recorder = PoseRecorder(self.record_path) if self.record_path else None
+        cap = cv2.VideoCapture(self.camera_index)
+        pose = mp.solutions.pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
+        seq = 0
+        last_inference = -np.inf
+        try:
+            while not self.stopping.is_set():
+                read_start = time.perf_counter()
+                # Keep reading so the camera buffer never holds stale frames
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                timestamp = time.time()
+                read_end = time.perf_counter()
+                if read_end - last_inference < self.inference_interval:
+                    continue
+                last_inference = read_end
+
+                # Landmarks are normalized, so a smaller input only costs precision
+                height, width = frame.shape[:2]
+                if 0 < self.input_width < width:
+                    frame = cv2.resize(frame, (self.input_width, round(height * self.input_width / width)), interpolation=cv2.INTER_AREA)
+                frame = cv2.flip(frame, 1)
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                results = pose.process(rgb_frame)
+
+                landmarks = None
+                if results.pose_landmarks:
+                    landmarks = np.array([(l.x, l.y, l.z, l.visibility) for l in results.pose_landmarks.landmark], dtype=np.float32)
+                seq += 1
+                sample = PoseSample(seq, timestamp, landmarks, (read_start, read_end, time.perf_counter()))
+                self.latest.publish(sample)
+                if recorder is not None:
+                    recorder.write(sample)
+        finally:
+            cap.release()
+            pose.close()
+            if recorder is not None:
+                recorder.close()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        self.stopping.set()
+        if self.is_alive():
+            self.join(timeout)
+
+
+class PoseReplay:
+    # Plays a recording back through the same interface as PoseWorker. Record
+    # times are taken relative to the first one and compared against clock,
+    # so a simulated clock replays as fast as the caller steps it.
+    def __init__(self, path: str, clock=time.time):
+        self.records = load_recording(path)
+        self.times = np.array(self.records["timestamp"])
+        if len(self.times):
+            self.times -= self.times[0]
+        self.clock = clock
+        self.start_time = None
+        self.latest = self
+
+    @property
+    def duration(self) -> float:
+        return float(self.times[-1]) if len(self.times) else 0.0
+
+    def start(self) -> None:
+        self.start_time = self.clock()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        pass
+
+    def is_alive(self) -> bool:
+        return self.start_time is not None and self.clock() - self.start_time <= self.duration
+
+    def get(self) -> PoseSample | None:
+        seq = int(np.searchsorted(self.times, self.clock() - self.start_time, side="right"))
+        if seq == 0:
+            return None
+        record = self.records[seq - 1]
+        landmarks = np.array(record["landmarks"]) if record["found"] else None
+        return PoseSample(seq, self.start_time + self.times[seq - 1], landmarks)
@@ -1,40 +1,23 @@
 #version 120
 
-uniform vec2 resolution;
-uniform vec2 center;
-uniform float radius;
-uniform float time;
-
-uniform vec3 color1;
-uniform vec3 color2;
-uniform vec3 color3;
-uniform float alpha;
-
-float noise(vec2 p) {
-    return fract(sin(dot(p ,vec2(12.9898,78.233))) * 43758.5453);
-}
-
-float smoothNoise(vec2 p) {
-    vec2 i = floor(p);
-    vec2 f = fract(p);
-    float a = noise(i);
-    float b = noise(i + vec2(1.0, 0.0));
-    float c = noise(i + vec2(0.0, 1.0));
-    float d = noise(i + vec2(1.0, 1.0));
-    vec2 u = f * f * (3.0 - 2.0 * f);
-    return mix(a, b, u.x) + (c - a)* u.y * (1.0 - u.x) + (d - b) * u.x * u.y;
-}
+varying vec2 center;
+varying float radius;
+varying float time;
+
+varying vec3 color1;
+varying vec3 color2;
+varying vec3 color3;
+varying float alpha;
+varying vec4 detail;
+
+// circle.frag's original five-octave value-noise fractal, baked over one
+// tiling period with one channel per octave count (see bake_fractal_noise)
+uniform sampler2D noiseTexture;
+uniform float noisePeriod;
+uniform float noiseScale;
 
 float fractal(vec2 p) {
-    float total = 0.0;
-    float amplitude = 1.0;
-    float frequency = 1.0;
-    for (int i = 0; i < 5; i++) {
-        total += amplitude * smoothNoise(p * frequency);
-        frequency *= 2.0;
-        amplitude *= 0.5;
-    }
-    return total;
+    return dot(texture2D(noiseTexture, p / noisePeriod), detail) * noiseScale;
 }
 
 void main() {
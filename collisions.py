@@ -0,0 +1,188 @@
+import numpy as np
+from consts import *
+
+# Half of the 3x3 neighbourhood; together with pairs inside a cell this visits
+# every neighbouring pair exactly once.
+FORWARD_NEIGHBORS = ((1, -1), (1, 0), (1, 1), (0, 1))
+# The whole 3x3 neighbourhood, for lookups between two different sets
+NEIGHBORHOOD = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+
+
+def hash_pos(pos: np.ndarray, cell_size: float = CELL_SIZE) -> np.ndarray:
+    return np.floor(np.asarray(pos) / cell_size).astype(np.int64)
+
+def cell_key(cells: np.ndarray) -> np.ndarray:
+    return cells[:, 0] * (1 << 32) + cells[:, 1]
+
+def expand_ranges(firsts: np.ndarray, starts: np.ndarray, counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Pair every firsts[i] with starts[i], ..., starts[i] + counts[i] - 1
+    total = int(counts.sum())
+    a = np.repeat(firsts, counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    b = np.repeat(starts, counts) + offsets
+    return a, b
+
+def size_levels(radius: np.ndarray, cell_size: float = CELL_SIZE) -> np.ndarray:
+    # Level k has cells of cell_size * 2**k; each body goes to the finest level
+    # whose cells are at least its diameter
+    return np.ceil(np.log2(np.maximum(2 * np.asarray(radius) / cell_size, 1))).astype(np.int64)
+
+def cell_table(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Bodies sorted by cell: keys[order] runs through unique_keys, cell i
+    # holding sorted bodies start[i], ..., start[i] + count[i] - 1
+    order = np.argsort(keys, kind="stable")
+    unique_keys, start, count = np.unique(keys[order], return_index=True, return_counts=True)
+    return order, unique_keys, start, count
+
+def find_cells(unique_keys: np.ndarray, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Which keys are occupied cells, and the index of each one found
+    j = np.minimum(np.searchsorted(unique_keys, keys), len(unique_keys) - 1)
+    found = np.flatnonzero(unique_keys[j] == keys)
+    return found, j[found]
+
+def neighborhood_keys(cells: np.ndarray) -> np.ndarray:
+    # Keys of the 3x3 block around each cell, nine per cell in a row
+    return cell_key((cells[:, None] + NEIGHBORHOOD).reshape(-1, 2))
+
+def within_one_cell(cells: np.ndarray, query_cells: np.ndarray) -> np.ndarray:
+    # Which query cells are in or next to one of cells, in one lookup each
+    reach = np.unique(neighborhood_keys(cells))
+    found, _ = find_cells(reach, cell_key(query_cells))
+    near = np.zeros(len(query_cells), dtype=bool)
+    near[found] = True
+    return near
+
+def candidate_pairs(pos: np.ndarray, cell_size: float = CELL_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    # Single grid, so only right for bodies no wider than a cell
+    n = len(pos)
+    if n < 2:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    cells = hash_pos(pos, cell_size)
+    order, unique_keys, start, count = cell_table(cell_key(cells))
+    cells = cells[order]
+    cell_of = np.repeat(np.arange(len(unique_keys)), count)
+    rank = np.arange(n) - start[cell_of]
+
+    # Same cell: each body pairs with the bodies sorted after it
+    a_parts, b_parts = [], []
+    a, b = expand_ranges(np.arange(n), np.arange(n) + 1, count[cell_of] - rank - 1)
+    a_parts.append(a)
+    b_parts.append(b)
+
+    for dx, dy in FORWARD_NEIGHBORS:
+        found, j = find_cells(unique_keys, cell_key(cells + (dx, dy)))
+        a, b = expand_ranges(found, start[j], count[j])
+        a_parts.append(a)
+        b_parts.append(b)
+
+    return order[np.concatenate(a_parts)], order[np.concatenate(b_parts)]
+
+def cross_pairs(query: np.ndarray, pos: np.ndarray, cell_size: float) -> tuple[np.ndarray, np.ndarray]:
+    # Pairs (i, j) of query[i] and pos[j] in the same or neighbouring cells.
+    # Query bodies nowhere near pos are dropped first, so a few large bodies
+    # cost one lookup per query body rather than nine.
+    empty = np.zeros(0, dtype=np.int64)
+    if len(query) == 0 or len(pos) == 0:
+        return empty, empty
+    cells = hash_pos(pos, cell_size)
+    query_cells = hash_pos(query, cell_size)
+    q = np.flatnonzero(within_one_cell(cells, query_cells))
+    if len(q) == 0:
+        return empty, empty
+
+    order, unique_keys, start, count = cell_table(cell_key(cells))
+    found, j = find_cells(unique_keys, neighborhood_keys(query_cells[q]))
+    a, b = expand_ranges(q[found // len(NEIGHBORHOOD)], start[j], count[j])
+    return a, order[b]
+
+def broadphase_pairs(pos: np.ndarray, radius: np.ndarray, cell_size: float = CELL_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    # Hierarchical grid: bodies are binned by size_levels and each level is
+    # hashed on its own cell size, so the finest cells stay small however
+    # large the largest body is. Two bodies can only touch when closer than
+    # the coarser one's cell size, so a pair is always found in neighbouring
+    # cells of the coarser level: within a level by its own grid, across
+    # levels by looking the finer body up in the coarser grid.
+    level = size_levels(radius, cell_size)
+    levels = np.unique(level)
+    if len(levels) <= 1:
+        return candidate_pairs(pos, cell_size * 2.0 ** (levels[0] if len(levels) else 0))
+
+    a_parts, b_parts = [], []
+    for k in levels:
+        members = np.flatnonzero(level == k)
+        size = cell_size * 2.0 ** k
+        a, b = candidate_pairs(pos[members], size)
+        a_parts += [members[a]]
+        b_parts += [members[b]]
+        finer = np.flatnonzero(level < k)
+        a, b = cross_pairs(pos[finer], pos[members], size)
+        a_parts += [finer[a]]
+        b_parts += [members[b]]
+    return np.concatenate(a_parts), np.concatenate(b_parts)
+
+def accumulate_corrections(pos: np.ndarray, radius: np.ndarray, imune: np.ndarray, a: np.ndarray, b: np.ndarray,
+                           out: np.ndarray, touched: np.ndarray) -> None:
+    # Adds each overlapping pair's push apart into out and flags both bodies in
+    # touched. Every correction is measured from pos as given, so out may be pos.
+    delta = pos[b] - pos[a]
+    dist_sq = (delta ** 2).sum(axis=1)
+    radius_sum = radius[a] + radius[b]
+
+    colliding = (dist_sq > 0) & (dist_sq < radius_sum * radius_sum)
+    a, b, delta, dist_sq, radius_sum = a[colliding], b[colliding], delta[colliding], dist_sq[colliding], radius_sum[colliding]
+
+    dist = np.sqrt(dist_sq)
+    correction = delta * ((radius_sum - dist) / (2 * dist))[:, None]
+
+    # Immune bodies push but are never pushed
+    n = len(out)
+    weight_a = ~imune[a]
+    weight_b = ~imune[b]
+    for axis in (0, 1):
+        out[:, axis] += np.bincount(b, correction[:, axis] * weight_b, minlength=n)
+        out[:, axis] -= np.bincount(a, correction[:, axis] * weight_a, minlength=n)
+
+    touched[a] = True
+    touched[b] = True
+
+def resolve_pairs(pos: np.ndarray, radius: np.ndarray, imune: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    touched = np.zeros(len(pos), dtype=bool)
+    accumulate_corrections(pos, radius, imune, a, b, pos, touched)
+    return touched
+
+def near_active(pos: np.ndarray, radius: np.ndarray, active: np.ndarray, cell_size: float = CELL_SIZE) -> np.ndarray:
+    # Active bodies plus the inactive ones an active body can reach, found
+    # the way broadphase_pairs finds pairs: on the grid of the coarser body's
+    # level, an active body of that level reaching any finer one, and an
+    # active finer body reaching one of that level
+    near = active.copy()
+    if not active.any():
+        return near
+    level = size_levels(radius, cell_size)
+    for k in np.unique(level):
+        size = cell_size * 2.0 ** k
+        for source, tested in ((level == k, level <= k), (level < k, level == k)):
+            source = np.flatnonzero(active & source)
+            test = np.flatnonzero(~near & tested)
+            if len(source) and len(test):
+                near[test] = within_one_cell(hash_pos(pos[source], size), hash_pos(pos[test], size))
+    return near
+
+def active_pairs(pos: np.ndarray, radius: np.ndarray, active: np.ndarray = None, cell_size: float = CELL_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    # Candidate pairs with at least one active body. Only bodies near an
+    # active one are hashed, so a mostly inactive scene is cheap.
+    if active is None or active.all():
+        return broadphase_pairs(pos, radius, cell_size)
+    subset = np.flatnonzero(near_active(pos, radius, active, cell_size))
+    a, b = broadphase_pairs(pos[subset], radius[subset], cell_size)
+    a, b = subset[a], subset[b]
+    keep = active[a] | active[b]
+    return a[keep], b[keep]
+
+def handle_collisions(pos: np.ndarray, radius: np.ndarray, imune: np.ndarray, active: np.ndarray = None) -> np.ndarray:
+    # Resolves overlaps in place and returns which bodies were touched.
+    # Inactive bodies are only pushed by active ones, never by each other.
+    a, b = active_pairs(pos, radius, active)
+    return resolve_pairs(pos, radius, imune, a, b)
@@ -1,15 +1,58 @@
 WIDTH = 1600
 HEIGHT = 900
 FPS = 120
+PHYSICS_HZ = 120
+MAX_PHYSICS_STEPS = 4  # Catch-up steps per frame before dropping time
+REFERENCE_HZ = 120  # Step rate the physics constants were tuned at
 MAX_PARTICLES = 4000
+PARTICLE_EVICTION = "oldest"  # Which live particles make room when MAX_PARTICLES is reached: "oldest" or "smallest"
 SPAWN_DELAY = 1000
 MAX_PARTICLE_AGE = 10
 MAX_PARTICLE_RADIUS = 300
 FRICTION = 0.02
+SLEEP_SPEED = 0.05  # Pixels per REFERENCE_HZ step below which a particle counts as still
+SLEEP_STEPS = 60  # Still steps in a row before a particle sleeps; 0 never sleeps
 AREA_SCALE = 0.003
 MAX_TRAIL_AGE = 0.5
+TRAIL_SAMPLES = 64  # Ring capacity per particle, ~MAX_TRAIL_AGE * FPS
+TRAIL_MODE = "history"  # "history" redraws stored samples, "feedback" fades an offscreen buffer
 
-CELL_SIZE = 50  # Should be >= max particle diameter
+CELL_SIZE = 50  # Finest broadphase cell; wider bodies are hashed on cells 2, 4, 8... times larger
+COLLISION_WORKERS = 0  # Extra processes solving collision strips in parallel; 0 solves on the main thread
+PHYSICS_PROCESS = False  # Step the world in its own process and draw from a shared-memory copy
+SHARED_BLOB_POINTS = 4096  # Blob points a shared frame holds; blobs past it go undrawn
+POSE_INFERENCE_HZ = 30  # Most pose estimations per second; LandmarkFilter predicts in between
+POSE_INPUT_WIDTH = 640  # Camera frames are scaled down to this width for inference; 0 keeps them as read
+POSE_REFERENCE_HZ = 30  # Pose rate the wrist-speed spawn constants were tuned at
+MAX_POSE_PREDICTION = 0.1  # Shortest time a pose is extrapolated past its last reading before it holds still; slower pose rates get 1.5 intervals
+CACHE_DIR = "cache"  # Compiled shaders and decoded textures, rebuilt whenever their sources change
+SPLINE_SEGMENTS = 20  # Most Catmull-Rom segments between two blob points
+FRACTAL_OCTAVES = 5  # Octaves in circle.frag; the shader loop is bounded by this
+
+
+class Tunables:
+    # Settings that may change while running, e.g. lowered by the quality
+    # governor under load. reset() restores full quality from the constants.
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.trail_stride = 1  # Record a trail sample every n-th step
+        self.max_trail_age = MAX_TRAIL_AGE
+        self.spline_segments = SPLINE_SEGMENTS
+        self.octaves = FRACTAL_OCTAVES
+        self.max_voices = MAX_PARTICLES
+        self.spawn_delay = SPAWN_DELAY
+
+    def apply(self, overrides: dict) -> None:
+        self.reset()
+        for name, value in overrides.items():
+            if not hasattr(self, name):
+                raise AttributeError(f"unknown tunable {name!r}")
+            setattr(self, name, value)
+
+
+tunables = Tunables()
 
 colors = [
     (1, 0.14, 0), 
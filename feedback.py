@@ -0,0 +1,106 @@
+from OpenGL.GL import *
+from OpenGL.GL.EXT.framebuffer_object import glGenFramebuffersEXT, glBindFramebufferEXT, glFramebufferTexture2DEXT, glCheckFramebufferStatusEXT
+from OpenGL.extensions import alternate
+from consts import tunables
+
+glGenFramebuffers = alternate("glGenFramebuffers", glGenFramebuffers, glGenFramebuffersEXT)
+glBindFramebuffer = alternate("glBindFramebuffer", glBindFramebuffer, glBindFramebufferEXT)
+glFramebufferTexture2D = alternate("glFramebufferTexture2D", glFramebufferTexture2D, glFramebufferTexture2DEXT)
+glCheckFramebufferStatus = alternate("glCheckFramebufferStatus", glCheckFramebufferStatus, glCheckFramebufferStatusEXT)
+
+RESIDUE = 0.05  # Share of a stamp still visible after max_trail_age
+
+
+def _fullscreen_quad(width: int, height: int) -> None:
+    glBegin(GL_QUADS)
+    glVertex2f(0, 0); glVertex2f(width, 0)
+    glVertex2f(width, height); glVertex2f(0, height)
+    glEnd()
+
+
+class FeedbackTrails:
+    # Trails without history: particles are stamped every frame into a
+    # persistent offscreen texture that fades toward transparent, and the
+    # texture is drawn over the blobs in place of the particle pass. Per frame
+    # this costs two fullscreen fades, one particle pass and one composite,
+    # however long or dense the trails are. The texture holds premultiplied
+    # colour so it composites exactly like drawing the particles directly.
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.last = None
+
+        self.texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+        previous = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+        self.fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.texture, 0)
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        if status == GL_FRAMEBUFFER_COMPLETE:
+            glClearColor(0, 0, 0, 0)
+            glClear(GL_COLOR_BUFFER_BIT)
+            glClearColor(0, 0, 0, 1)
+        glBindFramebuffer(GL_FRAMEBUFFER, previous)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError(f"trail framebuffer incomplete: {status:#x}")
+
+    def update(self, renderer, particles, now: float, alpha: float) -> None:
+        previous = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glUseProgram(0)
+
+        # Scale everything by the fade for the elapsed time, then take off one
+        # 8-bit step so the faintest levels reach zero instead of sticking
+        elapsed = 0.0 if self.last is None else now - self.last
+        self.last = now
+        keep = RESIDUE ** (elapsed / tunables.max_trail_age)
+        glBlendFunc(GL_ZERO, GL_SRC_ALPHA)
+        glColor4f(0, 0, 0, keep)
+        _fullscreen_quad(self.width, self.height)
+        glBlendEquation(GL_FUNC_REVERSE_SUBTRACT)
+        glBlendFunc(GL_ONE, GL_ONE)
+        glColor4f(1 / 255, 1 / 255, 1 / 255, 1 / 255)
+        _fullscreen_quad(self.width, self.height)
+        glBlendEquation(GL_FUNC_ADD)
+
+        glBlendFuncSeparate(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA, GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
+        renderer.begin()
+        particles.draw(renderer, now, alpha)
+        renderer.flush()
+
+        glBindFramebuffer(GL_FRAMEBUFFER, previous)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+
+    def composite(self) -> None:
+        # Texture rows run bottom-up, screen rows top-down
+        glUseProgram(0)
+        glEnable(GL_TEXTURE_2D)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glBlendFunc(GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
+        glColor4f(1, 1, 1, 1)
+        glBegin(GL_QUADS)
+        glTexCoord2f(0, 1); glVertex2f(0, 0)
+        glTexCoord2f(1, 1); glVertex2f(self.width, 0)
+        glTexCoord2f(1, 0); glVertex2f(self.width, self.height)
+        glTexCoord2f(0, 0); glVertex2f(0, self.height)
+        glEnd()
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glDisable(GL_TEXTURE_2D)
+
+    def clear(self) -> None:
+        previous = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glClearColor(0, 0, 0, 0)
+        glClear(GL_COLOR_BUFFER_BIT)
+        glClearColor(0, 0, 0, 1)
+        glBindFramebuffer(GL_FRAMEBUFFER, previous)
+        self.last = None
@@ -0,0 +1,61 @@
+import numpy as np
+
+from consts import *
+
+# Rungs from full quality down, each a set of tunables overrides. The cheap,
+# barely visible cuts (trail density, spline smoothness) go first; fewer
+# voices and slower spawning are the last resort.
+QUALITY_LADDER = [
+    {},
+    {"trail_stride": 2},
+    {"trail_stride": 2, "max_trail_age": 0.35, "spline_segments": 12},
+    {"trail_stride": 3, "max_trail_age": 0.25, "spline_segments": 8, "octaves": 3},
+    {"trail_stride": 4, "max_trail_age": 0.15, "spline_segments": 6, "octaves": 2, "max_voices": 512, "spawn_delay": SPAWN_DELAY * 2},
+    {"trail_stride": 4, "max_trail_age": 0.1, "spline_segments": 4, "octaves": 1, "max_voices": 128, "spawn_delay": SPAWN_DELAY * 4},
+]
+
+
+class QualityGovernor:
+    # Watches how long frames take to produce against the budget and walks
+    # QUALITY_LADDER. It steps down as soon as a full window of frames runs
+    # over; it steps back up only after `recover` seconds with clear headroom,
+    # so it does not oscillate around the limit.
+    def __init__(self, budget: float, ladder: list[dict] = QUALITY_LADDER, window: int = 30,
+                 downshift: float = 1.0, upshift: float = 0.7, settle: float = 0.5, recover: float = 3.0):
+        self.budget = budget
+        self.ladder = ladder
+        self.frame_times = np.zeros(window)
+        self.downshift = downshift
+        self.upshift = upshift
+        self.settle = settle
+        self.recover = recover
+        self.level = 0
+        self.set_level(0)
+
+    def set_level(self, level: int) -> None:
+        self.level = level
+        tunables.apply(self.ladder[level])
+        # Measure the new level from scratch before judging it
+        self.filled = 0
+        self.cooldown = self.settle
+        self.calm = 0.0
+
+    def update(self, work_time: float, frame_time: float) -> None:
+        # work_time excludes any frame-limiter sleep or buffer-swap wait;
+        # frame_time is wall time
+        self.frame_times[self.filled % len(self.frame_times)] = work_time
+        self.filled += 1
+        self.cooldown -= frame_time
+        if self.filled < len(self.frame_times) or self.cooldown > 0:
+            return
+
+        load = np.percentile(self.frame_times, 90) / self.budget
+        if load > self.downshift:
+            if self.level < len(self.ladder) - 1:
+                self.set_level(self.level + 1)
+        elif load < self.upshift and self.level > 0:
+            self.calm += frame_time
+            if self.calm >= self.recover:
+                self.set_level(self.level - 1)
+        else:
+            self.calm = 0.0
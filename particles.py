@@ -0,0 +1,284 @@
+import numpy as np
+import time
+import itertools
+from utils import snap_to_note
+from trails import TrailBuffer
+from consts import *
+
+
+def bounce_off_walls(pos: np.ndarray, ppos: np.ndarray, radius: np.ndarray, width: int, height: int, bounce: float = 1) -> None:
+    # Clamps circles inside the arena in place and reflects their velocity
+    radius = np.broadcast_to(np.asarray(radius, dtype=float).reshape(-1, 1), pos.shape)
+    vel = pos - ppos
+
+    # Left / Top
+    hit = pos - radius < 0
+    pos[hit] = radius[hit]
+    ppos[hit] = pos[hit] + vel[hit] * bounce
+
+    # Right / Bottom
+    limit = np.array([width, height]) - radius
+    hit = pos > limit
+    pos[hit] = limit[hit]
+    ppos[hit] = pos[hit] + vel[hit] * bounce
+
+
+# Voice ids stay unique across stores and slot moves
+_serials = itertools.count(1)
+
+
+class ParticleStore:
+    # Structure-of-arrays storage for Body state. Slots [0, count) are live and
+    # kept packed: removing a body moves the last live slot into the hole, so
+    # the free slots are always [count, capacity) and add/remove are O(1).
+    #
+    # With a limit the pool is allocated once at that size and never grows.
+    # Adding to a full pool evicts live bodies first, by the eviction policy:
+    # "oldest" removes the earliest spawned, "smallest" the smallest radius.
+    # Immune bodies are never evicted. Without a limit the pool doubles.
+    # trail_samples=0 keeps no trail history at all.
+    def __init__(self, capacity: int = 256, trail_samples: int = TRAIL_SAMPLES, limit: int = None, eviction: str = PARTICLE_EVICTION):
+        if eviction not in ("oldest", "smallest"):
+            raise ValueError(f"unknown eviction policy {eviction!r}")
+        self.count = 0
+        self.steps = 0
+        self.limit = limit
+        self.eviction = eviction
+        self.evicted = 0
+        self.bodies = []  # Body views, bodies[i].index == i; None for bulk spawns
+        self.palette: list[tuple[float, float, float]] = list(colors)
+        self.trails = TrailBuffer(0, trail_samples)
+        self._allocate(limit if limit is not None else capacity)
+
+    def _allocate(self, capacity: int) -> None:
+        old = self.count
+        arrays = {
+            "pos": np.zeros((capacity, 2)),
+            "ppos": np.zeros((capacity, 2)),
+            "last_pos": np.zeros((capacity, 2)),
+            "acc": np.zeros((capacity, 2)),
+            "radius": np.zeros(capacity),
+            "color_index": np.zeros(capacity, dtype=np.int32),
+            "time": np.zeros(capacity),
+            "imune": np.zeros(capacity, dtype=bool),
+            "frequency": np.zeros(capacity),
+            "serial": np.zeros(capacity, dtype=np.int64),
+            "onset": np.zeros(capacity),
+            "asleep": np.zeros(capacity, dtype=bool),
+            "still": np.zeros(capacity, dtype=np.int32),  # Steps in a row spent below SLEEP_SPEED
+        }
+        for name, array in arrays.items():
+            if old:
+                array[:old] = getattr(self, name)[:old]
+            setattr(self, name, array)
+        self.trails.resize(capacity)
+        self.capacity = capacity
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        return iter(self.bodies)
+
+    def color_id(self, color: tuple[float, float, float]) -> int:
+        color = tuple(color)
+        if color not in self.palette:
+            self.palette.append(color)
+        return self.palette.index(color)
+
+    def _make_room(self, k: int) -> None:
+        if self.limit is not None and self.count + k > self.capacity:
+            self._evict(self.count + k - self.capacity)
+        if self.count + k > self.capacity:
+            # Unbounded, or only immune bodies left to evict
+            self._allocate(max(self.capacity * 2, self.count + k))
+
+    def _evict(self, k: int) -> None:
+        n = self.count
+        key = self.time[:n] if self.eviction == "oldest" else self.radius[:n]
+        key = np.where(self.imune[:n], np.inf, key)
+        k = min(k, n - int(self.imune[:n].sum()))
+        if k <= 0:
+            return
+        victims = np.argpartition(key, k - 1)[:k]
+        # Highest index first so swap-remove never moves a victim
+        for i in np.sort(victims)[::-1]:
+            self.remove_at(i)
+        self.evicted += k
+
+    def spawn(self, radius, pos, color, spawn_time: float, acc=None) -> np.ndarray:
+        # Adds many bodies of one colour without creating Body views; returns
+        # their slots. More than a limited pool holds keeps the last ones.
+        radius = np.atleast_1d(np.asarray(radius, dtype=float))
+        pos = np.asarray(pos, dtype=float).reshape(-1, 2)
+        acc = np.zeros_like(pos) if acc is None else np.asarray(acc, dtype=float).reshape(-1, 2)
+        room = max(self.capacity - int(self.imune[:self.count].sum()), 0)
+        if self.limit is not None and len(radius) > room:
+            keep = len(radius) - room
+            radius, pos, acc = radius[keep:], pos[keep:], acc[keep:]
+        k = len(radius)
+        self._make_room(k)
+
+        rows = np.arange(self.count, self.count + k)
+        self.pos[rows] = pos
+        self.ppos[rows] = pos
+        self.last_pos[rows] = pos
+        self.acc[rows] = acc
+        self.radius[rows] = radius
+        self.color_index[rows] = self.color_id(color)
+        self.time[rows] = spawn_time
+        self.imune[rows] = False
+        self.frequency[rows] = 0
+        self.serial[rows] = [next(_serials) for _ in range(k)]
+        self.onset[rows] = spawn_time
+        self.asleep[rows] = False
+        self.still[rows] = 0
+        for i in rows:
+            self.trails.clear(i)
+        self.bodies.extend([None] * k)
+        self.count += k
+        return rows
+
+    def add(self, body, radius: float, pos, color, imune: bool, spawn_time: float) -> int:
+        self._make_room(1)
+        i = self.count
+        self.pos[i] = pos
+        self.ppos[i] = pos
+        self.last_pos[i] = pos
+        self.acc[i] = 0
+        self.radius[i] = radius
+        self.color_index[i] = self.color_id(color)
+        self.time[i] = spawn_time
+        self.imune[i] = imune
+        self.frequency[i] = 0
+        self.serial[i] = next(_serials)
+        self.onset[i] = spawn_time
+        self.asleep[i] = False
+        self.still[i] = 0
+        self.trails.clear(i)
+        self.bodies.append(body)
+        self.count += 1
+        return i
+
+    def remove(self, body) -> None:
+        self.remove_at(body.index)
+
+    def remove_at(self, i: int) -> None:
+        last = self.count - 1
+        if i != last:
+            for name in ("pos", "ppos", "last_pos", "acc", "radius", "color_index", "time", "imune", "frequency", "serial", "onset", "asleep", "still"):
+                array = getattr(self, name)
+                array[i] = array[last]
+            self.trails.move(i, last)
+            moved = self.bodies[last]
+            if moved is not None:
+                moved.index = i
+            self.bodies[i] = moved
+        self.bodies.pop()
+        self.count -= 1
+
+    def expire(self, now: float, max_age: float) -> None:
+        # Highest index first so swap-remove never moves an expired slot
+        for i in np.flatnonzero(now - self.time[:self.count] > max_age)[::-1]:
+            self.remove_at(i)
+
+    def _span(self, sl: slice | None) -> slice:
+        return slice(0, self.count) if sl is None else sl
+
+    def save_state(self) -> None:
+        self.last_pos[:self.count] = self.pos[:self.count]
+
+    def interpolated(self, alpha: float, sl: slice | None = None) -> np.ndarray:
+        sl = self._span(sl)
+        return self.last_pos[sl] + (self.pos[sl] - self.last_pos[sl]) * alpha
+
+    def awake_rows(self, sl: slice | None = None) -> slice | np.ndarray:
+        # Rows that integrate and bounce; the slice itself while nobody in it
+        # sleeps, so busy scenes keep working on views
+        sl = self._span(sl)
+        asleep = self.asleep[sl]
+        if not asleep.any():
+            return sl
+        return np.flatnonzero(~asleep) + sl.start
+
+    def wake(self, rows) -> None:
+        self.asleep[rows] = False
+        self.still[rows] = 0
+
+    def update(self, dt: float, sl: slice | None = None, now: float = None) -> None:
+        current_time = time.time() if now is None else now
+        sl = self._span(sl)
+        rows = self.awake_rows(sl)
+        pos = self.pos[rows]
+        ppos = self.ppos[rows]
+        acc = self.acc[rows]
+
+        # Friction and pitch are expressed per REFERENCE_HZ step so behaviour
+        # does not depend on the physics rate; acc is a one-off impulse
+        steps = dt * REFERENCE_HZ
+        vel = (pos - ppos) * (1 - FRICTION) ** steps
+        speed = np.hypot(vel[:, 0], vel[:, 1]) / steps
+        self.frequency[rows] = snap_to_note(speed * 70)
+        self.ppos[rows] = pos
+        self.pos[rows] = pos + vel + acc * dt
+        self.acc[rows] = 0
+
+        # Bodies slower than SLEEP_SPEED for SLEEP_STEPS steps in a row stop
+        # where they are until something awake pushes them
+        if SLEEP_STEPS > 0:
+            ids = np.arange(sl.start, sl.stop) if isinstance(rows, slice) else rows
+            still = np.where(speed < SLEEP_SPEED, self.still[rows] + 1, 0)
+            self.still[rows] = still
+            sleepy = ids[(still >= SLEEP_STEPS) & ~self.imune[rows]]
+            self.asleep[sleepy] = True
+            self.ppos[sleepy] = self.pos[sleepy]
+            self.frequency[sleepy] = 0
+
+        if self.trails.samples == 0:
+            return
+        self.steps += 1
+        if self.steps % tunables.trail_stride == 0:
+            pos, ppos = self.pos[rows], self.ppos[rows]
+            moved = np.flatnonzero(((pos - ppos) ** 2).sum(axis=1) > 1**2)
+            ids = np.arange(sl.start, sl.stop) if isinstance(rows, slice) else rows
+            self.trails.push(ids[moved], ppos[moved], current_time)
+        # Sleepers leave no new samples, so only rows with a trail left need trimming
+        if not isinstance(rows, slice):
+            rows = np.flatnonzero(self.trails.length[sl]) + sl.start
+        self.trails.trim(rows, current_time, tunables.max_trail_age)
+
+    def constrain_to_bounds(self, width: int, height: int, bounce: float = 1, sl: slice | None = None) -> None:
+        rows = self.awake_rows(sl)
+        if isinstance(rows, slice):
+            bounce_off_walls(self.pos[rows], self.ppos[rows], self.radius[rows], width, height, bounce)
+            return
+        pos, ppos = self.pos[rows], self.ppos[rows]
+        bounce_off_walls(pos, ppos, self.radius[rows], width, height, bounce)
+        self.pos[rows] = pos
+        self.ppos[rows] = ppos
+
+    def publish_voices(self, voices) -> None:
+        n = self.count
+        voices.publish(self.serial[:n], self.frequency[:n], self.radius[:n] * AREA_SCALE, self.onset[:n])
+
+    def draw(self, renderer, now: float, alpha: float = 1.0, sl: slice | None = None) -> None:
+        # Each particle's trail ghosts, oldest first, then the particle itself
+        sl = self._span(sl)
+        owner, trail_pos, trail_time = self.trails.gather(sl)
+        fade = 1 - (now - trail_time) / tunables.max_trail_age
+        visible = fade > 0
+        owner, trail_pos, fade = owner[visible], trail_pos[visible], fade[visible]
+
+        index = np.arange(sl.start, sl.stop)
+        life = 1 - (now - self.time) / MAX_PARTICLE_AGE
+        rows = np.concatenate([owner, index])
+        order = np.argsort(rows, kind="stable")
+        rows = rows[order]
+        drawn = ~self.imune[rows]
+        rows = rows[drawn]
+
+        centers = np.concatenate([trail_pos, self.interpolated(alpha, sl)])[order][drawn]
+        radius = self.radius[rows] * np.concatenate([fade, np.ones(len(index))])[order][drawn]
+        alpha = life[rows] * np.concatenate([fade, np.ones(len(index))])[order][drawn]
+        color = np.array(self.palette)[self.color_index[rows]]
+        renderer.add_many(centers, radius, now - self.time[rows], color, color, color * 0.75, alpha)
@@ -0,0 +1,232 @@
+import json
+import time
+import numpy as np
+import pygame
+from OpenGL.GL import *
+
+from utils import surface_texture, draw_image
+
+MAIN_THREAD = 0
+POSE_THREAD = 1
+PHYSICS_THREAD = 2
+THREAD_NAMES = {MAIN_THREAD: "main", POSE_THREAD: "pose-worker", PHYSICS_THREAD: "physics"}
+
+
+def _noop(*args, **kwargs) -> None:
+    pass
+
+
+class FrameProfiler:
+    # Lap timer for the main loop. Each lap charges the time since the previous
+    # one to a stage. Per-frame stage totals go into a fixed ring for the HUD,
+    # and every lap goes into an event ring for trace export. While disabled
+    # the timing methods are no-ops bound on the instance.
+    TIMING_METHODS = ("begin_frame", "lap", "span")
+
+    def __init__(self, stages: list[str], frames: int = 600, events: int = 16384, enabled: bool = False):
+        self.stages = list(stages)
+        self.index = {name: i for i, name in enumerate(self.stages)}
+
+        self.durations = np.zeros((frames, len(self.stages)))
+        self.frame_start = np.zeros(frames)
+        self.frame_time = np.zeros(frames)
+        self.frames = 0
+
+        self.event_stage = np.zeros(events, dtype=np.int16)
+        self.event_thread = np.zeros(events, dtype=np.int8)
+        self.event_start = np.zeros(events)
+        self.event_duration = np.zeros(events)
+        self.events = 0
+
+        self.row = None
+        self.set_enabled(enabled)
+
+    def set_enabled(self, enabled: bool) -> None:
+        self.enabled = enabled
+        for name in self.TIMING_METHODS:
+            if enabled:
+                self.__dict__.pop(name, None)
+            else:
+                setattr(self, name, _noop)
+        # A frame in progress when timing switches on is recorded from here
+        self.row = None
+        if enabled:
+            self._open_frame(time.perf_counter())
+
+    def _open_frame(self, now: float) -> None:
+        slot = self.frames % len(self.frame_time)
+        self.row = self.durations[slot]
+        self.row[:] = 0
+        self.frame_start[slot] = now
+        self.last = now
+
+    def begin_frame(self) -> None:
+        now = time.perf_counter()
+        if self.row is not None:
+            slot = self.frames % len(self.frame_time)
+            self.frame_time[slot] = now - self.frame_start[slot]
+            self.frames += 1
+        self._open_frame(now)
+
+    def _event(self, stage: int, start: float, duration: float, thread: int) -> None:
+        e = self.events % len(self.event_stage)
+        self.event_stage[e] = stage
+        self.event_thread[e] = thread
+        self.event_start[e] = start
+        self.event_duration[e] = duration
+        self.events += 1
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        i = self.index[stage]
+        self.row[i] += now - self.last
+        self._event(i, self.last, now - self.last, MAIN_THREAD)
+        self.last = now
+
+    def span(self, stage: str, start: float, end: float, thread: int = POSE_THREAD) -> None:
+        # Work timed elsewhere (e.g. on the pose thread), charged to this frame
+        i = self.index[stage]
+        self.row[i] += end - start
+        self._event(i, start, end - start, thread)
+
+    def recent(self) -> tuple[np.ndarray, np.ndarray]:
+        # Completed frames, oldest first: frame times (k,) and stage times (k, stages)
+        k = min(self.frames, len(self.frame_time))
+        rows = (np.arange(k) + self.frames - k) % len(self.frame_time)
+        return self.frame_time[rows], self.durations[rows]
+
+    def summary(self) -> dict:
+        frame_time, durations = self.recent()
+        if len(frame_time) == 0:
+            return {}
+        p50, p95, p99 = np.percentile(frame_time, [50, 95, 99]) * 1000
+        return {
+            "frames": len(frame_time),
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "max_ms": float(frame_time.max() * 1000),
+            "stages_ms": dict(zip(self.stages, (durations.mean(axis=0) * 1000).tolist())),
+        }
+
+    def export_chrome_trace(self, path: str) -> None:
+        # Trace Event Format, viewable in chrome://tracing or ui.perfetto.dev
+        n = min(self.events, len(self.event_stage))
+        events = (np.arange(n) + self.events - n) % len(self.event_stage)
+        k = min(self.frames, len(self.frame_time))
+        frames = (np.arange(k) + self.frames - k) % len(self.frame_time)
+        origin = min(self.event_start[events].min(initial=np.inf), self.frame_start[frames].min(initial=np.inf))
+
+        trace = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}} for tid, name in THREAD_NAMES.items()]
+        for f in frames:
+            trace.append({"name": "frame", "ph": "X", "pid": 1, "tid": MAIN_THREAD,
+                          "ts": (self.frame_start[f] - origin) * 1e6, "dur": self.frame_time[f] * 1e6})
+        for e in events:
+            trace.append({"name": self.stages[self.event_stage[e]], "ph": "X", "pid": 1, "tid": int(self.event_thread[e]),
+                          "ts": (self.event_start[e] - origin) * 1e6, "dur": self.event_duration[e] * 1e6})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+class StartupTimer:
+    # Time between startup milestones, from `start` (taken before the heavy
+    # imports when given) to the first frame on screen
+    def __init__(self, start: float = None):
+        self.start = self.last = time.perf_counter() if start is None else start
+        self.marks = []
+
+    def mark(self, name: str) -> None:
+        now = time.perf_counter()
+        self.marks.append((name, now - self.last))
+        self.last = now
+
+    def report(self) -> str:
+        lines = [f"{name:<12} {seconds * 1000:8.1f} ms" for name, seconds in self.marks]
+        lines.append(f"{'total':<12} {(self.last - self.start) * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
+class ProfilerHUD:
+    # Overlay with frame-time percentiles, a frame-time graph and one bar per
+    # stage against the frame budget. Text is re-rendered a few times a second.
+    def __init__(self, profiler: FrameProfiler, budget_ms: float, x: int = 10, y: int = 10, refresh: float = 0.25):
+        pygame.font.init()
+        self.profiler = profiler
+        self.budget_ms = budget_ms
+        self.x = x
+        self.y = y
+        self.refresh = refresh
+        self.font = pygame.font.Font(None, 20)
+        self.line = self.font.get_linesize()
+        self.label_width = 190
+        self.bar_width = 200
+        self.texture = None
+        self.text_size = (0, 0)
+        self.updated = 0.0
+        self.summary = {}
+
+    def _render_text(self) -> None:
+        s = self.summary
+        header = f"frame p50 {s['p50_ms']:.1f}  p95 {s['p95_ms']:.1f}  p99 {s['p99_ms']:.1f}  max {s['max_ms']:.1f} ms"
+        width = max(self.font.size(header)[0], self.label_width)
+        surface = pygame.Surface((width, self.line * (len(s["stages_ms"]) + 2)), pygame.SRCALPHA)
+        surface.blit(self.font.render(header, True, (255, 255, 255)), (0, 0))
+        for i, (name, ms) in enumerate(s["stages_ms"].items()):
+            y = (i + 2) * self.line
+            value = self.font.render(f"{ms:.2f} ms", True, (255, 255, 255))
+            surface.blit(self.font.render(name, True, (255, 255, 255)), (0, y))
+            surface.blit(value, (self.label_width - 10 - value.get_width(), y))
+        self.texture = surface_texture(surface, self.texture)
+        self.text_size = surface.get_size()
+
+    def draw(self) -> None:
+        now = time.perf_counter()
+        if now - self.updated > self.refresh:
+            self.summary = self.profiler.summary()
+            if self.summary:
+                self._render_text()
+            self.updated = now
+        if not self.summary:
+            return
+
+        glUseProgram(0)
+        x, y, line = self.x, self.y, self.line
+        graph_height = 60
+        width = max(self.text_size[0], self.label_width + self.bar_width) + 10
+        height = self.text_size[1] + graph_height + 20
+
+        glColor4f(0, 0, 0, 0.6)
+        glBegin(GL_QUADS)
+        glVertex2f(x - 5, y - 5); glVertex2f(x + width, y - 5)
+        glVertex2f(x + width, y + height); glVertex2f(x - 5, y + height)
+        glEnd()
+
+        # Stage bars, full width at the frame budget, red when a stage alone blows it
+        bars_y = y + 2 * line
+        glBegin(GL_QUADS)
+        for i, ms in enumerate(self.summary["stages_ms"].values()):
+            glColor4f(*((0.9, 0.2, 0.2, 0.9) if ms > self.budget_ms else (0.3, 0.8, 0.4, 0.9)))
+            top = bars_y + i * line + 3
+            right = x + self.label_width + min(ms / self.budget_ms, 1) * self.bar_width
+            glVertex2f(x + self.label_width, top); glVertex2f(right, top)
+            glVertex2f(right, top + line - 6); glVertex2f(x + self.label_width, top + line - 6)
+        glEnd()
+
+        # Frame-time graph, budget line at half height
+        frame_time, _ = self.profiler.recent()
+        graph_y = y + self.text_size[1] + 10
+        scale = graph_height / (2 * self.budget_ms)
+        glColor4f(1, 1, 1, 0.3)
+        glBegin(GL_LINES)
+        glVertex2f(x, graph_y + graph_height / 2); glVertex2f(x + width - 10, graph_y + graph_height / 2)
+        glEnd()
+        glColor4f(1, 0.8, 0.2, 1)
+        points = np.empty((len(frame_time), 2))
+        points[:, 0] = x + np.arange(len(frame_time)) * (width - 10) / max(len(frame_time) - 1, 1)
+        points[:, 1] = graph_y + graph_height - np.minimum(frame_time * 1000 * scale, graph_height)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(2, GL_DOUBLE, 0, points)
+        glDrawArrays(GL_LINE_STRIP, 0, len(points))
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+        draw_image(self.texture, x, y, *self.text_size)
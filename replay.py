@@ -0,0 +1,75 @@
+import argparse
+import hashlib
+import time
+import numpy as np
+
+from world import World
+from timestep import FixedStepper
+from capture import PoseReplay
+from consts import *
+
+
+def world_digest(world: World) -> str:
+    # Fingerprint of the simulation state, for checking that replays match
+    n = len(world.particles)
+    digest = hashlib.sha1()
+    for array in (world.particles.pos[:n], world.particles.radius[:n], world.blobs.pos):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def replay_headless(path: str, seed: int = 0, width: int = WIDTH, height: int = HEIGHT, frame_rate: float = FPS, on_frame=None) -> dict:
+    # Drives the world from a recording on a virtual clock, one render frame
+    # at a time and as fast as the machine allows. Same recording and seed
+    # give the same world.
+    clock = [0.0]
+    source = PoseReplay(path, clock=lambda: clock[0])
+    world = World(width, height, clock=lambda: clock[0], seed=seed)
+    stepper = FixedStepper(PHYSICS_HZ, MAX_PHYSICS_STEPS)
+    frame_time = 1 / frame_rate
+
+    source.start()
+    lastPoseSeq = 0
+    frames = steps = peak = 0
+    started = time.perf_counter()
+    while source.is_alive():
+        sample = source.latest.get()
+        newPose = sample is not None and sample.seq != lastPoseSeq
+        if newPose:
+            lastPoseSeq = sample.seq
+
+        world.apply_pose(sample, newPose)
+        for _ in range(stepper.advance(frame_time)):
+            world.step(stepper.dt)
+            steps += 1
+        if on_frame is not None:
+            on_frame(world, stepper.alpha)
+
+        peak = max(peak, len(world.particles))
+        frames += 1
+        clock[0] += frame_time
+    elapsed = time.perf_counter() - started
+
+    return {
+        "frames": frames,
+        "steps": steps,
+        "simulated_s": clock[0],
+        "wall_s": elapsed,
+        "fps": frames / elapsed if elapsed else 0.0,
+        "peak_particles": peak,
+        "particles": len(world.particles),
+        "blobs": len(world.blobs),
+        "digest": world_digest(world),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a pose recording without a window, camera or audio")
+    parser.add_argument("recording")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fps", type=float, default=FPS, help="render frames per simulated second")
+    args = parser.parse_args()
+
+    stats = replay_headless(args.recording, args.seed, frame_rate=args.fps)
+    for key, value in stats.items():
+        print(f"{key:>15}: {value:.3f}" if isinstance(value, float) else f"{key:>15}: {value}")
@@ -1,67 +1,310 @@
-
 import pygame
 from OpenGL.GL import *
-from OpenGL.GL.shaders import compileShader, compileProgram
+from OpenGL.GL.shaders import compileShader
+from OpenGL.GL.ARB.instanced_arrays import glVertexAttribDivisorARB
+from OpenGL.GL.ARB.draw_instanced import glDrawArraysInstancedARB
+from OpenGL.GL.ARB.get_program_binary import glInitGetProgramBinaryARB, glGetProgramBinary, glProgramBinary, glProgramParameteri
+from OpenGL.extensions import alternate
+from assetcache import cache_key, cached_arrays, load_blob, store_blob
+from consts import WIDTH, HEIGHT, FRACTAL_OCTAVES, tunables
+import ctypes
+import inspect
 import time
 import numpy as np
 
-WIDTH, HEIGHT = 800, 600
+glVertexAttribDivisor = alternate("glVertexAttribDivisor", glVertexAttribDivisor, glVertexAttribDivisorARB)
+glDrawArraysInstanced = alternate("glDrawArraysInstanced", glDrawArraysInstanced, glDrawArraysInstancedARB)
 
 VERT_SHADER = """
 #version 120
 
+uniform vec2 resolution;
+uniform int maxOctaves;
+
 attribute vec2 position;
+attribute vec4 circle;
+attribute vec3 circleColor1;
+attribute vec3 circleColor2;
+attribute vec3 circleColor3;
+attribute float circleAlpha;
+attribute float circleOctaves;
+
+varying vec2 center;
+varying float radius;
+varying float time;
+varying vec3 color1;
+varying vec3 color2;
+varying vec3 color3;
+varying float alpha;
+varying vec4 detail;
 
 void main() {
-    gl_Position = vec4(position, 0.0, 1.0);
+    // Circles arrive in top-left screen pixels; the fragment shader works in
+    // gl_FragCoord space, which starts bottom-left
+    center = vec2(circle.x, resolution.y - circle.y);
+    radius = circle.z;
+    time = circle.w;
+    color1 = circleColor1;
+    color2 = circleColor2;
+    color3 = circleColor3;
+    alpha = circleAlpha;
+
+    // Blend weights over the baked octave counts 1, 2, 3 and 5, so detail
+    // fades in and out smoothly as a circle grows or shrinks
+    float octaves = clamp(min(circleOctaves, float(maxOctaves)), 1.0, 5.0);
+    detail = vec4(
+        clamp(2.0 - octaves, 0.0, 1.0),
+        clamp(1.0 - abs(octaves - 2.0), 0.0, 1.0),
+        octaves < 3.0 ? clamp(octaves - 2.0, 0.0, 1.0) : clamp((5.0 - octaves) * 0.5, 0.0, 1.0),
+        clamp((octaves - 3.0) * 0.5, 0.0, 1.0));
+
+    // Cover only the circle's bounding box
+    vec2 pixel = center + position * radius;
+    gl_Position = vec4(pixel / resolution * 2.0 - 1.0, 0.0, 1.0);
 }
 
 """
 
+# Per-instance layout: center.xy, radius, time, color1, color2, color3, alpha, octaves
+INSTANCE_ATTRIBUTES = (("circle", 4), ("circleColor1", 3), ("circleColor2", 3), ("circleColor3", 3), ("circleAlpha", 1), ("circleOctaves", 1))
+INSTANCE_FLOATS = sum(size for _, size in INSTANCE_ATTRIBUTES)
+NOISE_PERIOD = 16  # Lattice cells before the baked pattern repeats
+NOISE_TEXELS = 64  # Texels per lattice cell; the finest octave gets 4
+BAKED_OCTAVES = (1, 2, 3, FRACTAL_OCTAVES)  # Octave count in each RGBA channel
+FRACTAL_SUM = 2 - 2 ** (1 - FRACTAL_OCTAVES)  # Largest fractal value
+
+def octave_lod(radius, alpha):
+    # Octave k of the pattern has lattice cells radius / (5 * 2**k) pixels
+    # across; octaves with cells under ~2px only alias. Each halving of alpha
+    # drops one more, since faint ghosts hide fine detail.
+    detail = np.log2(np.maximum(radius, 1e-3) / 10) + 1
+    faint = np.log2(1 / np.clip(alpha, 1e-3, 1))
+    return np.clip(detail - faint, 1, FRACTAL_OCTAVES)
+
+def bake_fractal_noise(period: int = NOISE_PERIOD, texels: int = NOISE_TEXELS, seed: int = 0) -> np.ndarray:
+    # The shader's fractal sums one value noise at doubling frequencies, so a
+    # lattice that repeats every `period` cells makes every octave tile too.
+    # Returns (size, size, 4) in [0, 1], channel c holding BAKED_OCTAVES[c]
+    # octaves plus the average of the rest, so all channels share a tone.
+    size = period * texels
+    lattice = np.random.default_rng(seed).random((period, period))
+    rows = np.arange(size)
+    octaves = []
+    for k in range(FRACTAL_OCTAVES):
+        # Smoothstep-weighted neighbours along one axis, applied on both
+        u = (rows + 0.5) / texels * 2 ** k
+        cell = np.floor(u).astype(int)
+        f = u - cell
+        s = f * f * (3 - 2 * f)
+        weights = np.zeros((size, period))
+        weights[rows, cell % period] = 1 - s
+        weights[rows, (cell + 1) % period] += s
+        octaves.append(weights @ lattice @ weights.T * 0.5 ** k)
+
+    channels = []
+    for count in BAKED_OCTAVES:
+        rest = sum(0.5 ** k for k in range(count, FRACTAL_OCTAVES))
+        channels.append(sum(octaves[:count]) + 0.5 * rest)
+    return np.stack(channels, axis=-1) / FRACTAL_SUM
+
+def noise_mipmaps(seed: int = 0) -> list[np.ndarray]:
+    # 8-bit mip chain of the baked noise, down to 1x1
+    level = bake_fractal_noise(seed=seed)
+    levels = []
+    while True:
+        levels.append((level * 255 + 0.5).astype(np.uint8))
+        size = len(level)
+        if size == 1:
+            return levels
+        level = level.reshape(size // 2, 2, size // 2, 2, 4).mean(axis=(1, 3))
+
+def load_noise_texture(seed: int = 0) -> int:
+    # Mipmapped so tiny circles average the pattern instead of sparkling.
+    # Baking takes a while, so the chain is cached by the baking code itself.
+    key = cache_key(inspect.getsource(bake_fractal_noise), inspect.getsource(noise_mipmaps),
+                    NOISE_PERIOD, NOISE_TEXELS, BAKED_OCTAVES, FRACTAL_OCTAVES, seed)
+    levels = cached_arrays("noise", key, lambda: noise_mipmaps(seed))
+    texture_id = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, texture_id)
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    for mip, level in enumerate(levels):
+        size = len(level)
+        glTexImage2D(GL_TEXTURE_2D, mip, GL_RGBA, size, size, 0, GL_RGBA, GL_UNSIGNED_BYTE, level)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
+    glBindTexture(GL_TEXTURE_2D, 0)
+    return texture_id
+
+def _program_from_binary(data: bytes) -> int | None:
+    # Stored as the 4-byte format followed by the driver's binary. Anything
+    # the driver will not load, truncated files included, is a cache miss.
+    if len(data) <= 4:
+        return None
+    program = glCreateProgram()
+    binary = np.frombuffer(data, dtype=np.uint8)
+    try:
+        glProgramBinary(program, int(binary[:4].view(np.uint32)[0]), binary[4:], len(binary) - 4)
+        if glGetProgramiv(program, GL_LINK_STATUS) == GL_TRUE:
+            return program
+    except Exception:
+        pass
+    glDeleteProgram(program)
+    return None
+
+def _program_binary(program: int) -> bytes:
+    length = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+    binary = np.zeros(length, dtype=np.uint8)
+    written = GLsizei()
+    binary_format = GLenum()
+    glGetProgramBinary(program, length, written, binary_format, binary)
+    return np.uint32(binary_format.value).tobytes() + binary[:written.value].tobytes()
+
 def load_shader():
+    # Linked programs are cached as driver binaries keyed by the sources and
+    # the driver, when the driver can hand them out
     with open("circle.frag") as f:
         frag_shader = f.read()
-    return compileProgram(
-        compileShader(VERT_SHADER, GL_VERTEX_SHADER),
-        compileShader(frag_shader, GL_FRAGMENT_SHADER)
-    )
-
-def setup_vertex_data(shader):
-    # Your quad vertices (two triangles)
-    vertices = np.array([
-        -1.0, -1.0,
-         1.0, -1.0,
-         1.0,  1.0,
-        -1.0, -1.0,
-         1.0,  1.0,
-        -1.0,  1.0
-    ], dtype=np.float32)
-
-    vbo = glGenBuffers(1)
-    glBindBuffer(GL_ARRAY_BUFFER, vbo)
-    glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
-
-    pos_loc = glGetAttribLocation(shader, "position")
-    glEnableVertexAttribArray(pos_loc)
-    glVertexAttribPointer(pos_loc, 2, GL_FLOAT, GL_FALSE, 0, None)
-
-def draw_circle_shader(shader, x, y, r, t, c1, c2, c3, alpha=1.0):
-    glUseProgram(shader)
-    glUniform2f(glGetUniformLocation(shader, "resolution"), WIDTH, HEIGHT)
-    glUniform3f(glGetUniformLocation(shader, "color1"), *c1)  # red-ish
-    glUniform3f(glGetUniformLocation(shader, "color2"), *c2)  # teal-ish
-    glUniform3f(glGetUniformLocation(shader, "color3"), *c3)  # white
-    glUniform1f(glGetUniformLocation(shader, "alpha"), alpha)  # white
-    glUniform2f(glGetUniformLocation(shader, "center"), x, y)
-    glUniform1f(glGetUniformLocation(shader, "radius"), r)
-    glUniform1f(glGetUniformLocation(shader, "time"), t)
-    glDrawArrays(GL_TRIANGLES, 0, 6)
+    attributes = ["position"] + [name for name, _ in INSTANCE_ATTRIBUTES]
+    cacheable = bool(glInitGetProgramBinaryARB()) and glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+    if cacheable:
+        key = cache_key(VERT_SHADER, frag_shader, attributes,
+                        glGetString(GL_VENDOR), glGetString(GL_RENDERER), glGetString(GL_VERSION))
+        data = load_blob("circle", key)
+        program = _program_from_binary(data) if data else None
+        if program is not None:
+            return program
+
+    program = glCreateProgram()
+    glAttachShader(program, compileShader(VERT_SHADER, GL_VERTEX_SHADER))
+    glAttachShader(program, compileShader(frag_shader, GL_FRAGMENT_SHADER))
+    # Keep the per-vertex attribute at location 0; some drivers need it
+    for location, name in enumerate(attributes):
+        glBindAttribLocation(program, location, name)
+    if cacheable:
+        glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+    glLinkProgram(program)
+    if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+        raise RuntimeError(glGetProgramInfoLog(program))
+    if cacheable:
+        store_blob("circle", key, _program_binary(program))
+    return program
+
+
+class CircleRenderer:
+    # Collects circles into one per-instance buffer and draws them all with a
+    # single instanced call, in the order they were added.
+    def __init__(self, shader, resolution: tuple[int, int], capacity: int = 4096):
+        self.shader = shader
+        self.resolution = resolution
+        self.count = 0
+        self.data = np.zeros((capacity, INSTANCE_FLOATS), dtype=np.float32)
+
+        # Unit quad corners (two triangles), scaled to each circle's bounds
+        vertices = np.array([
+            -1.0, -1.0,
+             1.0, -1.0,
+             1.0,  1.0,
+            -1.0, -1.0,
+             1.0,  1.0,
+            -1.0,  1.0
+        ], dtype=np.float32)
+
+        self.quad_vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.quad_vbo)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+
+        self.instance_vbo = glGenBuffers(1)
+        self.instance_capacity = 0
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        self.noise_texture = load_noise_texture()
+        self.resolution_loc = glGetUniformLocation(shader, "resolution")
+        self.octaves_loc = glGetUniformLocation(shader, "maxOctaves")
+        self.noise_loc = glGetUniformLocation(shader, "noiseTexture")
+        self.noise_period_loc = glGetUniformLocation(shader, "noisePeriod")
+        self.noise_scale_loc = glGetUniformLocation(shader, "noiseScale")
+        self.position_loc = glGetAttribLocation(shader, "position")
+        self.instance_locs = [(glGetAttribLocation(shader, name), size) for name, size in INSTANCE_ATTRIBUTES]
+
+    def begin(self) -> None:
+        self.count = 0
+
+    def _reserve(self, extra: int) -> None:
+        needed = self.count + extra
+        if needed > len(self.data):
+            data = np.zeros((max(needed, len(self.data) * 2), INSTANCE_FLOATS), dtype=np.float32)
+            data[:self.count] = self.data[:self.count]
+            self.data = data
+
+    def add(self, x, y, r, t, c1, c2, c3, alpha=1.0) -> None:
+        self._reserve(1)
+        self.data[self.count] = (x, y, r, t, *c1, *c2, *c3, alpha, octave_lod(r, alpha))
+        self.count += 1
+
+    def add_many(self, centers, radius, t, c1, c2, c3, alpha) -> None:
+        k = len(centers)
+        self._reserve(k)
+        rows = self.data[self.count:self.count + k]
+        rows[:, 0:2] = centers
+        rows[:, 2] = radius
+        rows[:, 3] = t
+        rows[:, 4:7] = c1
+        rows[:, 7:10] = c2
+        rows[:, 10:13] = c3
+        rows[:, 13] = alpha
+        rows[:, 14] = octave_lod(rows[:, 2], rows[:, 13])
+        self.count += k
+
+    def flush(self) -> None:
+        if self.count == 0:
+            return
+        instances = self.data[:self.count]
+
+        glUseProgram(self.shader)
+        glUniform2f(self.resolution_loc, *self.resolution)
+        glUniform1i(self.octaves_loc, tunables.octaves)
+        glUniform1i(self.noise_loc, 0)
+        glUniform1f(self.noise_period_loc, NOISE_PERIOD)
+        glUniform1f(self.noise_scale_loc, FRACTAL_SUM)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, self.noise_texture)
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+        if self.count > self.instance_capacity:
+            self.instance_capacity = len(self.data)
+            glBufferData(GL_ARRAY_BUFFER, self.data.nbytes, None, GL_STREAM_DRAW)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, instances.nbytes, instances)
+
+        stride = INSTANCE_FLOATS * 4
+        offset = 0
+        for loc, size in self.instance_locs:
+            glEnableVertexAttribArray(loc)
+            glVertexAttribPointer(loc, size, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(offset))
+            glVertexAttribDivisor(loc, 1)
+            offset += size * 4
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.quad_vbo)
+        glEnableVertexAttribArray(self.position_loc)
+        glVertexAttribPointer(self.position_loc, 2, GL_FLOAT, GL_FALSE, 0, None)
+
+        glDrawArraysInstanced(GL_TRIANGLES, 0, 6, self.count)
+
+        # Leave attribute state clean for the fixed-function drawing
+        for loc, _ in self.instance_locs:
+            glVertexAttribDivisor(loc, 0)
+            glDisableVertexAttribArray(loc)
+        glDisableVertexAttribArray(self.position_loc)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glUseProgram(0)
+        self.count = 0
 
 def main():
     pygame.init()
     pygame.display.set_mode((WIDTH, HEIGHT), pygame.OPENGL | pygame.DOUBLEBUF)
     shader = load_shader()
-    setup_vertex_data(shader) 
+    renderer = CircleRenderer(shader, pygame.display.get_window_size())
     clock = pygame.time.Clock()
     start = time.time()
 
@@ -73,8 +316,10 @@ def main():
         t = time.time() - start
         glClear(GL_COLOR_BUFFER_BIT)
 
-        draw_circle_shader(shader, 400+t*100, 300, 80, t, (255/255,0/255,178/255), (255/255, 0, 114/255), (163/255,0,64/255))
-        draw_circle_shader(shader, 600, 200, 50, t + 2, (0.0, 1.0, 0.0), (1.0, 0.0, 1.0), (1.0, 1.0, 1.0))
+        renderer.begin()
+        renderer.add(400+t*100, 300, 80, t, (255/255,0/255,178/255), (255/255, 0, 114/255), (163/255,0,64/255))
+        renderer.add(600, 200, 50, t + 2, (0.0, 1.0, 0.0), (1.0, 0.0, 1.0), (1.0, 1.0, 1.0))
+        renderer.flush()
 
         pygame.display.flip()
         clock.tick(60)
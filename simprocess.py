@@ -0,0 +1,313 @@
+import multiprocessing as mp
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+from world import World
+from particles import ParticleStore
+from blob import BlobStore
+from timestep import FixedStepper
+from audioManager import AudioManager
+from governor import QUALITY_LADDER
+from capture import PoseWorker, PoseReplay, NUM_LANDMARKS
+from profiler import FrameProfiler, PHYSICS_THREAD
+from consts import *
+
+PHYSICS_STAGES = ["blobs", "collide", "particles"]
+PALETTE_SIZE = 64
+SHARED_BLOBS = SHARED_BLOB_POINTS // 4
+
+HEADER = np.dtype([("seq", "<i8"), ("reading", "<i8"), ("quality", "<i8"), ("width", "<i8"), ("height", "<i8"),
+                   ("stop", "u1"), ("done", "u1")])
+
+# Everything about a frame besides the big arrays. time and accumulator place
+# the frame on the wall clock so the renderer can interpolate; pose_timing and
+# stages carry pose-thread and physics timings for the render-side profiler.
+FRAME_META = np.dtype([("time", "<f8"), ("accumulator", "<f8"), ("dt", "<f8"),
+                       ("particles", "<i8"), ("points", "<i8"), ("blobs", "<i8"), ("palette", "<i8"),
+                       ("pose_seq", "<i8"), ("pose_timing", "<f8", 3), ("stages", "<f8", (len(PHYSICS_STAGES), 2)),
+                       ("found", "u1"), ("landmarks", "<f4", (NUM_LANDMARKS, 4))])
+
+
+def _frame_fields(particles: int, trail_samples: int) -> list[tuple[str, tuple, str]]:
+    return [
+        ("meta", (1,), FRAME_META),
+        ("pos", (particles, 2), "<f8"), ("last_pos", (particles, 2), "<f8"),
+        ("radius", (particles,), "<f8"), ("time", (particles,), "<f8"),
+        ("color_index", (particles,), "<i4"), ("imune", (particles,), "u1"),
+        ("trail_pos", (particles, trail_samples, 2), "<f4"), ("trail_time", (particles, trail_samples), "<f8"),
+        ("trail_head", (particles,), "<i8"), ("trail_length", (particles,), "<i8"),
+        ("palette", (PALETTE_SIZE, 3), "<f8"),
+        ("point_pos", (SHARED_BLOB_POINTS, 2), "<f8"), ("point_last", (SHARED_BLOB_POINTS, 2), "<f8"),
+        ("blob_size", (SHARED_BLOBS,), "<i8"), ("blob_radius", (SHARED_BLOBS,), "<f8"), ("blob_color", (SHARED_BLOBS, 3), "<f8"),
+    ]
+
+def _layout(buf, fields: list, offset: int = 0) -> tuple[dict, int]:
+    # Views at 64-byte aligned offsets; with buf=None only measures
+    views = {}
+    for name, shape, dtype in fields:
+        dtype = np.dtype(dtype)
+        if buf is not None:
+            views[name] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        offset += -(-int(np.prod(shape)) * dtype.itemsize // 64) * 64
+    return views, offset
+
+
+class SharedWorld:
+    # What drawing needs from a World, double-buffered in one shared-memory
+    # block. Frame seq lives in buffer seq % 2, and header seq is the newest
+    # complete one, 0 before the first. The renderer marks the seq it is
+    # drawing as `reading` (0 when none); the physics side skips publishing
+    # rather than overwrite that buffer, so a frame is never torn and neither
+    # side waits on the other's work. The lock only guards the few header
+    # fields exchanged at the handover.
+    def __init__(self, lock, particles: int = MAX_PARTICLES, trail_samples: int = TRAIL_SAMPLES, name: str = None):
+        self.lock = lock
+        self.particles = particles
+        self.trail_samples = trail_samples
+        fields = _frame_fields(particles, trail_samples)
+        _, header_size = _layout(None, [("header", (1,), HEADER)])
+        _, frame_size = _layout(None, fields)
+        size = header_size + 2 * frame_size
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size if name is None else 0)
+        self.header = _layout(self.shm.buf, [("header", (1,), HEADER)])[0]["header"][0]
+        self.frames = [_layout(self.shm.buf, fields, header_size + k * frame_size)[0] for k in range(2)]
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def publish(self, world: World, accumulator: float, dt: float, pose, stages: np.ndarray) -> bool:
+        # Physics side. Returns False when the renderer still holds the buffer.
+        with self.lock:
+            seq = int(self.header["seq"]) + 1
+            if seq > 2 and self.header["reading"] == seq - 2:
+                return False
+        frame = self.frames[seq % 2]
+
+        p = world.particles
+        n = min(p.count, self.particles)
+        for name in ("pos", "last_pos", "radius", "time", "color_index", "imune"):
+            frame[name][:n] = getattr(p, name)[:n]
+        if self.trail_samples:
+            frame["trail_pos"][:n] = p.trails.pos[:n]
+            frame["trail_time"][:n] = p.trails.time[:n]
+            frame["trail_head"][:n] = p.trails.head[:n]
+            frame["trail_length"][:n] = p.trails.length[:n]
+        palette = min(len(p.palette), PALETTE_SIZE)
+        frame["palette"][:palette] = p.palette[:palette]
+
+        # Blobs past the shared capacity are left undrawn
+        b = world.blobs
+        fits = np.cumsum(b.size) <= SHARED_BLOB_POINTS
+        k = min(int(fits.sum()), SHARED_BLOBS)
+        points = int(b.size[:k].sum())
+        if k:
+            frame["point_pos"][:points] = b.pos[:points]
+            frame["point_last"][:points] = b.last[:points]
+            frame["blob_size"][:k] = b.size[:k]
+            frame["blob_radius"][:k] = b.radius[:k]
+            frame["blob_color"][:k] = b.colors[:k]
+
+        meta = frame["meta"][0]
+        meta["time"] = world.clock()
+        meta["accumulator"] = accumulator
+        meta["dt"] = dt
+        meta["particles"], meta["points"], meta["blobs"], meta["palette"] = n, points, k, palette
+        meta["stages"] = stages
+        meta["found"] = world.landmarks is not None
+        if world.landmarks is not None:
+            meta["landmarks"] = world.landmarks
+        if pose is not None:
+            meta["pose_seq"] = pose.seq
+            if pose.timing is not None:
+                meta["pose_timing"] = pose.timing
+
+        with self.lock:
+            self.header["seq"] = seq
+        return True
+
+    def acquire(self) -> tuple[int, dict] | None:
+        # Render side: the newest complete frame, held until release()
+        with self.lock:
+            seq = int(self.header["seq"])
+            if seq == 0:
+                return None
+            self.header["reading"] = seq
+        return seq, self.frames[seq % 2]
+
+    def release(self) -> None:
+        with self.lock:
+            self.header["reading"] = 0
+
+    def close(self, unlink: bool = False) -> None:
+        self.header = self.frames = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class FrameView:
+    # Draw-only stand-in for World over one shared frame buffer. The stores
+    # are bound to the shared arrays once; each frame only sets their counts.
+    draw = World.draw
+
+    def __init__(self, frame: dict, trail_samples: int, profiler: FrameProfiler):
+        self.frame = frame
+        self.meta = frame["meta"][0]
+        self.profiler = profiler
+        self.clock = time.time
+        self.particles = ParticleStore(0, trail_samples=trail_samples)
+        for name in ("pos", "last_pos", "radius", "time", "color_index"):
+            setattr(self.particles, name, frame[name])
+        self.particles.imune = frame["imune"].view(bool)
+        trails = self.particles.trails
+        trails.pos, trails.time, trails.head, trails.length = frame["trail_pos"], frame["trail_time"], frame["trail_head"], frame["trail_length"]
+        self.blobs = BlobStore()
+
+    def refresh(self) -> None:
+        meta, frame = self.meta, self.frame
+        self.particles.count = int(meta["particles"])
+        self.particles.palette = frame["palette"][:int(meta["palette"])]
+        k, points = int(meta["blobs"]), int(meta["points"])
+        blobs = self.blobs
+        blobs.pos, blobs.last = frame["point_pos"][:points], frame["point_last"][:points]
+        blobs.size, blobs.radius, blobs.colors = frame["blob_size"][:k], frame["blob_radius"][:k], frame["blob_color"][:k]
+        blobs.start = np.cumsum(blobs.size) - blobs.size
+        blobs.blobs = range(k)
+
+    @property
+    def landmarks(self) -> np.ndarray | None:
+        return self.meta["landmarks"] if self.meta["found"] else None
+
+    @property
+    def alpha(self) -> float:
+        # How far wall time has moved past the frame, in physics steps
+        return min((self.meta["accumulator"] + self.clock() - self.meta["time"]) / self.meta["dt"], 1.0)
+
+
+def run_physics(name: str, lock, options: dict) -> None:
+    # Body of the physics process: pose input, the world, audio and the fixed
+    # step loop, publishing a frame after every batch of steps
+    shared = SharedWorld(lock, options["particles"], options["trail_samples"], name)
+    header = shared.header
+    replay = options["replay"]
+    poseWorker = PoseReplay(replay) if replay else PoseWorker(1, options["record"], options["pose_hz"], options["pose_width"])
+    if not replay:
+        poseWorker.start()
+    world = audio = None
+    try:
+        # The window size is only known once the renderer has opened it
+        while header["width"] == 0 and not header["stop"]:
+            time.sleep(0.005)
+        profiler = FrameProfiler(PHYSICS_STAGES, enabled=True)
+        world = World(int(header["width"]), int(header["height"]), seed=options["seed"], profiler=profiler,
+                      trail_samples=options["trail_samples"], max_particles=options["particles"],
+                      collision_workers=options["collision_workers"], pose_hz=options["pose_hz"])
+        stepper = FixedStepper(PHYSICS_HZ, MAX_PHYSICS_STEPS)
+        audio = AudioManager(world.voices)
+        audio.start()
+        if replay:
+            poseWorker.start()
+
+        quality = 0
+        lastPoseSeq = 0
+        stages = np.zeros((len(PHYSICS_STAGES), 2))
+        last = time.perf_counter()
+        while not header["stop"] and poseWorker.is_alive():
+            if header["quality"] != quality:
+                quality = int(header["quality"])
+                tunables.apply(QUALITY_LADDER[quality])
+
+            sample = poseWorker.latest.get()
+            newPose = sample is not None and sample.seq != lastPoseSeq
+            if newPose:
+                lastPoseSeq = sample.seq
+            world.apply_pose(sample, newPose)
+
+            now = time.perf_counter()
+            steps = stepper.advance(now - last)
+            last = now
+            if steps:
+                # Per stage: start of the first step and time over all of them
+                stages[:, 0] = time.perf_counter()
+                stages[:, 1] = 0
+                for _ in range(steps):
+                    profiler.begin_frame()
+                    world.step(stepper.dt)
+                    stages[:, 1] += profiler.row
+                stages[1:, 0] += np.cumsum(stages[:-1, 1])
+                shared.publish(world, stepper.accumulator, stepper.dt, sample, stages)
+            time.sleep(max(stepper.dt - stepper.accumulator - (time.perf_counter() - last), 0))
+    finally:
+        header["done"] = 1
+        poseWorker.stop()
+        if audio is not None:
+            audio.stop()
+        if world is not None:
+            world.close()
+        shared.close()
+
+
+class PhysicsProcess:
+    # Render-side handle on the physics process. Start it early: the camera
+    # and pose model load there while the window opens; the world starts
+    # once start_world() gives it the window size.
+    def __init__(self, record: str = None, replay: str = None, seed: int = None, pose_hz: float = POSE_INFERENCE_HZ,
+                 pose_width: int = POSE_INPUT_WIDTH, collision_workers: int = COLLISION_WORKERS,
+                 trail_samples: int = TRAIL_SAMPLES, particles: int = MAX_PARTICLES):
+        # Spawned, not forked, so the child never inherits the window or GL state
+        context = mp.get_context("spawn")
+        self.trail_samples = trail_samples
+        self.shared = SharedWorld(context.Lock(), particles, trail_samples)
+        options = dict(record=record, replay=replay, seed=seed, pose_hz=pose_hz, pose_width=pose_width,
+                       collision_workers=collision_workers, trail_samples=trail_samples, particles=particles)
+        # Not a daemon: the collision solver may start worker processes of its own
+        self.process = context.Process(target=run_physics, args=(self.shared.name, self.shared.lock, options), name="physics")
+        self.process.start()
+        self.views = None
+        self.lastPoseSeq = 0
+        self.lastSeq = 0
+
+    def start_world(self, width: int, height: int, profiler: FrameProfiler) -> None:
+        self.views = [FrameView(frame, self.trail_samples, profiler) for frame in self.shared.frames]
+        self.profiler = profiler
+        self.shared.header["height"] = height
+        self.shared.header["width"] = width
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive() and not self.shared.header["done"]
+
+    def set_quality(self, level: int) -> None:
+        self.shared.header["quality"] = level
+
+    def acquire(self) -> FrameView | None:
+        held = self.shared.acquire()
+        if held is None:
+            return None
+        seq, _ = held
+        view = self.views[seq % 2]
+        view.refresh()
+        if seq != self.lastSeq:
+            # Charge work done elsewhere to this frame, once per new frame
+            meta = view.meta
+            self.lastSeq = seq
+            for stage, (start, duration) in zip(PHYSICS_STAGES, meta["stages"]):
+                self.profiler.span(stage, start, start + duration, PHYSICS_THREAD)
+            if meta["pose_seq"] != self.lastPoseSeq and meta["pose_timing"][0] > 0:
+                read_start, read_end, inference_end = meta["pose_timing"]
+                self.profiler.span("capture", read_start, read_end)
+                self.profiler.span("inference", read_end, inference_end)
+            self.lastPoseSeq = int(meta["pose_seq"])
+        return view
+
+    def release(self) -> None:
+        self.shared.release()
+
+    def close(self, timeout: float = 5.0) -> None:
+        self.shared.header["stop"] = 1
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.views = None
+        self.shared.close(unlink=True)
@@ -1,197 +1,199 @@
+import time
+STARTED = time.perf_counter()  # Before the heavy imports, for the startup report
+
 import pygame
 from pygame.locals import *
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from random import random, randint
+import argparse
 import math
-import time
-import cv2
-import mediapipe as mp
-from collections import deque
-
-from pygame.math import Vector2
-from blob import Blob, Body
-from collections import defaultdict
-from utils import load_texture, draw_image
+
+from world import World
+from timestep import FixedStepper
+from utils import load_texture, draw_image, PolygonBatch
 from audioManager import AudioManager
-from shaders import load_shader, setup_vertex_data
+from shaders import load_shader, CircleRenderer
+from capture import PoseWorker, PoseReplay, LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_HIP, X, Y
+from profiler import FrameProfiler, ProfilerHUD, StartupTimer
+from governor import QualityGovernor
+from feedback import FeedbackTrails
+from simprocess import PhysicsProcess
+import assetcache
 from consts import *
 
 
-def hash_pos(pos: Vector2):
-    return int(pos.x // CELL_SIZE), int(pos.y // CELL_SIZE)
+# Main loop sections in the order they run; capture and inference are timed
+# on the pose thread
+PROFILE_STAGES = ["wait", "events", "pose", "overlay", "blobs", "collide", "particles",
+                  "draw_blobs", "draw_particles", "hud", "flip", "capture", "inference"]
 
 def exprandom(m):
     x = random()
     return -m * math.log(x)
 
-def check_and_resolve_collision(a: Body, b: Body):
-    delta = b.pos - a.pos
-    dist_sq = delta.length_squared()
-    radius_sum = a.radius + b.radius
-
-    if dist_sq == 0 or dist_sq >= radius_sum * radius_sum:
-        return  # no collision
-
-    dist = dist_sq**0.5
-    overlap = radius_sum - dist
-
-    if delta.magnitude() > 0:
-        correction = delta.normalize() * (overlap / 2)
-
-        if not a.imune:
-            a.pos -= correction
-        if not b.imune:
-            b.pos += correction
-        a.wave.time_offset = 0
-
-def handle_collisions(bodies: list[Body]):
-    grid = defaultdict(list)
-
-    # Fill grid
-    for body in bodies:
-        key = hash_pos(body.pos)
-        grid[key].append(body)
-
-    # Check local neighborhoods
-    for key, cell in grid.items():
-        neighbors = []
-        for dx in (-1, 0, 1):
-            for dy in (-1, 0, 1):
-                neighbors.extend(grid.get((key[0] + dx, key[1] + dy), []))
-
-        for i, a in enumerate(cell):
-            for b in neighbors:
-                if a is not b:
-                    check_and_resolve_collision(a, b)
-
-def map_to_pixels(coords: Vector2):
-    return Vector2(coords.x * WIDTH, coords.y * HEIGHT)
-
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", metavar="PATH", help="save the live pose stream to a recording")
+    parser.add_argument("--replay", metavar="PATH", help="play a recording instead of the camera")
+    parser.add_argument("--seed", type=int, help="seed the world's random numbers")
+    parser.add_argument("--profile", action="store_true", help="start with the profiler and its overlay on (F3 toggles)")
+    parser.add_argument("--trace", metavar="PATH", help="profile and write a Chrome trace on exit (F4 writes one any time)")
+    parser.add_argument("--fixed-quality", action="store_true", help="never lower quality to hold the frame rate")
+    parser.add_argument("--trails", choices=["history", "feedback"], default=TRAIL_MODE,
+                        help="redraw stored trail samples, or fade an offscreen buffer each frame")
+    parser.add_argument("--pose-hz", type=float, default=POSE_INFERENCE_HZ, help="most pose estimations per second (0 for every camera frame)")
+    parser.add_argument("--pose-width", type=int, default=POSE_INPUT_WIDTH, help="camera frame width for pose estimation (0 for native)")
+    parser.add_argument("--collision-workers", type=int, default=COLLISION_WORKERS, metavar="N",
+                        help="extra processes solving collisions in screen strips (0 for single-core)")
+    parser.add_argument("--physics-process", action=argparse.BooleanOptionalAction, default=PHYSICS_PROCESS,
+                        help="step the world in its own process and draw from a shared-memory copy")
+    parser.add_argument("--startup-report", action="store_true", help="print how long each part of startup took")
+    args = parser.parse_args()
+    startup = StartupTimer(STARTED)
+    startup.mark("imports")
+
+    # The camera and pose model take longest to come up; they load on the pose
+    # thread, or in the physics process, while the window and assets do. A
+    # replay starts with the first frame.
+    physics = None
+    if args.physics_process:
+        physics = PhysicsProcess(args.record, args.replay, args.seed, args.pose_hz, args.pose_width,
+                                 args.collision_workers, 0 if args.trails == "feedback" else TRAIL_SAMPLES)
+    else:
+        poseWorker = PoseReplay(args.replay) if args.replay else PoseWorker(1, args.record, args.pose_hz, args.pose_width)
+        if not args.replay:
+            poseWorker.start()
+    lastPoseSeq = 0
+
     pygame.init()
 
     screen = pygame.display.set_mode((WIDTH, HEIGHT), DOUBLEBUF | OPENGL | FULLSCREEN)
     actual_size = pygame.display.get_window_size()
     WIDTH, HEIGHT = actual_size
+    startup.mark("window")
 
     gluOrtho2D(0, WIDTH, HEIGHT, 0)
     glEnable(GL_BLEND)
     glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
     glClearColor(0.0, 0.0, 0.0, 1.0)
     shader = load_shader()
-    setup_vertex_data(shader) 
-
-    colorCounter = 0
-
-    # Initialize MediaPipe Pose
-    mp_pose = mp.solutions.pose
-    pose = mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5)
+    renderer = CircleRenderer(shader, (WIDTH, HEIGHT), MAX_PARTICLES)
+    polygons = PolygonBatch()
+    feedback = FeedbackTrails(WIDTH, HEIGHT) if args.trails == "feedback" else None
+    startup.mark("shaders")
 
     imgs = [load_texture("assets/blue.png"), load_texture("assets/green.png"), load_texture("assets/pink.png"), load_texture("assets/white.png"), load_texture("assets/yellow.png"),]
     active_img = randint(0, len(imgs)-1)
+    startup.mark("textures")
 
-    # Start webcam
-    cap = cv2.VideoCapture(1)
+    profiler = FrameProfiler(PROFILE_STAGES, enabled=args.profile or bool(args.trace))
+    hud = ProfilerHUD(profiler, 1000 / FPS)
+    showHud = args.profile
 
     clock = pygame.time.Clock()
-    lastTick = pygame.time.get_ticks()
-    lastWrist = False
-    particles = []
-    blobs = deque()
-    rightHand = Body(100, Vector2(0, 0), (1, 1, 1), True)
-    audioManager = AudioManager(particles)
-    audioManager.start()
-
-    while True:
+    governor = None if args.fixed_quality else QualityGovernor(1 / FPS)
+    if physics is not None:
+        # Audio follows the world into the physics process
+        physics.start_world(WIDTH, HEIGHT, profiler)
+    else:
+        world = World(WIDTH, HEIGHT, seed=args.seed, profiler=profiler, trail_samples=0 if feedback else TRAIL_SAMPLES,
+                      collision_workers=args.collision_workers, pose_hz=args.pose_hz)
+        stepper = FixedStepper(PHYSICS_HZ, MAX_PHYSICS_STEPS)
+        audioManager = AudioManager(world.voices)
+        audioManager.start()
+        if args.replay:
+            poseWorker.start()
+    startup.mark("audio")
+
+    running = True
+    workTime = 0.0
+    while running:
+        profiler.begin_frame()
         dt = clock.tick(FPS) / 1000
-        currentTime = time.time()
+        profiler.lap("wait")
+        workStart = time.perf_counter()
+        if governor is not None:
+            # The last frame's work, without the limiter's sleep or the wait
+            # in flip, which on a vsynced display is at least a refresh
+            governor.update(workTime, dt)
+            if physics is not None:
+                physics.set_quality(governor.level)
 
         glClear(GL_COLOR_BUFFER_BIT)
 
         for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                cap.release()
-                pygame.quit()
-
-        ret, frame = cap.read()
-        if not ret:
+            if event.type == pygame.QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
+                running = False
+            elif event.type == KEYDOWN and event.key == K_F3:
+                showHud = not showHud
+                profiler.set_enabled(showHud or bool(args.trace))
+            elif event.type == KEYDOWN and event.key == K_F4:
+                profiler.export_chrome_trace(time.strftime("trace-%Y%m%d-%H%M%S.json"))
+        profiler.lap("events")
+
+        # The camera closed or failed, or the recording ended
+        if not (physics.is_alive() if physics is not None else poseWorker.is_alive()):
             break
 
-        frame = cv2.flip(frame, 1)
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = pose.process(rgb_frame)
-        
         glUseProgram(0)
         glEnable(GL_BLEND)
         glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 
-        if results.pose_landmarks:
-            landmarks = results.pose_landmarks.landmark
-                
-            body_width = abs(landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER].x - landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER].x)*WIDTH
-            body_heigth = abs(landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER].y - landmarks[mp_pose.PoseLandmark.LEFT_HIP].y)*HEIGHT
-            draw_image(imgs[active_img], landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER].x*WIDTH, landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER].y * HEIGHT, body_width, body_heigth)
-
-            if not lastWrist or landmarks[mp_pose.PoseLandmark.LEFT_WRIST].visibility < 0.5:
-                lastWristSpeed = 0
-                lastWrist = map_to_pixels(Vector2(landmarks[mp_pose.PoseLandmark.LEFT_WRIST].x, landmarks[mp_pose.PoseLandmark.LEFT_WRIST].y))
-            wrist = map_to_pixels(Vector2(landmarks[mp_pose.PoseLandmark.LEFT_WRIST].x, landmarks[mp_pose.PoseLandmark.LEFT_WRIST].y))
-            wristSpeed = wrist - lastWrist
-            wristSpeedDir = wristSpeed
-            wristSpeed = wristSpeed.magnitude()
-
-            rightHand.pos = map_to_pixels(Vector2(landmarks[mp_pose.PoseLandmark.RIGHT_WRIST].x, landmarks[mp_pose.PoseLandmark.RIGHT_WRIST].y))
-
-            if wristSpeed > 0:
-                if pygame.time.get_ticks() - lastTick > SPAWN_DELAY / (wristSpeed):
-                    radius = MAX_PARTICLE_RADIUS / (wristSpeed)
-                    if (radius > MAX_PARTICLE_RADIUS / 3):
-                        blobs.append(Blob(wrist, 16, radius, colors[colorCounter]))
-                    elif(radius > 1):
-                        body = Body(radius, wrist, colors[colorCounter])
-                        body.acc = Vector2(wristSpeedDir * 10)
-                        particles.append(body)
-                    lastTick = pygame.time.get_ticks()
-                    colorCounter = (colorCounter + 1) % len(colors)
-            lastWrist = wrist
+        if physics is not None:
+            # Held until drawn, so the physics process never overwrites it
+            frame = physics.acquire()
+            landmarks = frame.landmarks if frame is not None else None
+        else:
+            sample = poseWorker.latest.get()
+            newPose = sample is not None and sample.seq != lastPoseSeq
+            if newPose:
+                lastPoseSeq = sample.seq
+                if sample.timing is not None:
+                    read_start, read_end, inference_end = sample.timing
+                    profiler.span("capture", read_start, read_end)
+                    profiler.span("inference", read_end, inference_end)
+            world.apply_pose(sample, newPose)
+            landmarks = world.landmarks
+        profiler.lap("pose")
+        if landmarks is not None:
+            body_width = abs(landmarks[LEFT_SHOULDER, X] - landmarks[RIGHT_SHOULDER, X])*WIDTH
+            body_heigth = abs(landmarks[LEFT_SHOULDER, Y] - landmarks[LEFT_HIP, Y])*HEIGHT
+            draw_image(imgs[active_img], landmarks[RIGHT_SHOULDER, X]*WIDTH, landmarks[RIGHT_SHOULDER, Y] * HEIGHT, body_width, body_heigth)
         else:
             active_img = randint(0, len(imgs)-1)
-            rightHand.pos = Vector2(-rightHand.radius, -rightHand.radius)
-
-
-        remove = 0
-        for blob in blobs:
-            if (currentTime - blob.time > MAX_PARTICLE_AGE):
-                remove += 1
-                for point in blob.points:
-                    body = Body(random()*30, point.pos, blob.color)
-                    body.acc = Vector2(random() * 2 - 1, random() * 2 - 1) * 200
-                    particles.append(body)
-            else:
-                blob.update(dt)
-                blob.draw()
-                for point in blob.points:
-                    point.constrain_to_bounds(WIDTH, HEIGHT)
-        for i in range(remove):
-            blobs.popleft()
-
-        points = []
-        for blob in blobs:
-            for point in blob.points:
-                points.append(point)
-
-        handle_collisions(list(particles) + points + [rightHand])
-
-        for particle in particles:
-            elapsedTime = currentTime - particle.time
-            if elapsedTime > MAX_PARTICLE_AGE:
-                particles.remove(particle)
-                continue
-            particle.update(dt)
-            particle.constrain_to_bounds(WIDTH, HEIGHT)
-            particle.draw(shader, elapsedTime / MAX_PARTICLE_AGE)
-        
-        # rightHand.draw(shader, dt)
-    
+        profiler.lap("overlay")
+
+        if physics is not None:
+            if frame is not None:
+                frame.draw(renderer, polygons, frame.alpha, feedback)
+                physics.release()
+        else:
+            for _ in range(stepper.advance(dt)):
+                world.step(stepper.dt)
+            world.draw(renderer, polygons, stepper.alpha, feedback)
+
+        if showHud:
+            hud.draw()
+            profiler.lap("hud")
+
+        workTime = time.perf_counter() - workStart
         pygame.display.flip()
+        profiler.lap("flip")
+
+        if startup is not None:
+            startup.mark("first_frame")
+            if args.startup_report:
+                print(startup.report())
+                print(f"asset cache: {assetcache.stats['hits']} hits, {assetcache.stats['misses']} misses")
+            startup = None
+
+    if args.trace:
+        profiler.export_chrome_trace(args.trace)
+    if physics is not None:
+        physics.close()
+    else:
+        poseWorker.stop()
+        audioManager.stop()
+        world.close()
+    pygame.quit()
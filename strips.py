@@ -0,0 +1,150 @@
+import multiprocessing as mp
+import numpy as np
+from multiprocessing import shared_memory
+
+from collisions import hash_pos, size_levels, broadphase_pairs, accumulate_corrections, handle_collisions, near_active
+from consts import *
+
+
+def _layout(buf, capacity: int, strips: int) -> dict:
+    # Views over one shared block: the inputs every strip reads, then one
+    # correction and touched row per strip so no two writers share memory
+    shapes = [("pos", (capacity, 2), np.float64), ("radius", (capacity,), np.float64),
+              ("correction", (strips, capacity, 2), np.float64),
+              ("imune", (capacity,), np.bool_), ("active", (capacity,), np.bool_), ("touched", (strips, capacity), np.bool_)]
+    views, offset = {}, 0
+    for name, shape, dtype in shapes:
+        views[name] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return views
+
+def _block_size(capacity: int, strips: int) -> int:
+    return capacity * (16 + 8 + strips * 16 + 2 + strips)
+
+def solve_strip(views: dict, strip: int, n: int, lo: float, hi: float, cell_size: float = CELL_SIZE) -> None:
+    # The strip owns cell columns [lo, hi) and reads a halo past hi as wide
+    # as the coarsest broadphase cell, which is as far as any contact reaches.
+    # A pair belongs to the strip holding its lower column, so every pair is
+    # solved exactly once. Pairs of two inactive bodies are skipped, as in
+    # handle_collisions.
+    pos, radius, imune, active = views["pos"][:n], views["radius"][:n], views["imune"][:n], views["active"][:n]
+    correction, touched = views["correction"][strip, :n], views["touched"][strip, :n]
+    correction[:] = 0
+    touched[:] = False
+
+    column = hash_pos(pos[:, 0], cell_size)
+    halo = 2 ** int(size_levels(radius, cell_size).max()) if n else 1
+    local = np.flatnonzero((column >= lo) & (column < hi + halo))
+    a, b = broadphase_pairs(pos[local], radius[local], cell_size)
+    a, b = local[a], local[b]
+    owned = (np.minimum(column[a], column[b]) < hi) & (active[a] | active[b])
+    accumulate_corrections(pos, radius, imune, a[owned], b[owned], correction, touched)
+
+def _strip_worker(conn, strip: int) -> None:
+    shm = views = None
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        name, capacity, strips, n, lo, hi = message
+        if shm is None or shm.name != name:
+            views = None
+            if shm is not None:
+                shm.close()
+            shm = shared_memory.SharedMemory(name=name)
+            views = _layout(shm.buf, capacity, strips)
+        solve_strip(views, strip, n, lo, hi)
+        conn.send(strip)
+    views = None
+    if shm is not None:
+        shm.close()
+
+
+class StripSolver:
+    # Drop-in for handle_collisions that splits the arena into vertical strips
+    # of cell columns, balanced by body count, and solves them in parallel:
+    # strip 0 on the calling thread, the rest in worker processes over shared
+    # memory. Corrections are summed in strip order, so a given input always
+    # gives the same output. It matches the single-core solver up to
+    # floating-point summation order.
+    def __init__(self, workers: int, capacity: int = MAX_PARTICLES + 256, min_bodies: int = 0):
+        self.strips = workers + 1
+        self.min_bodies = min_bodies
+        self.shm = None
+        self.views = None
+        self._allocate(capacity)
+
+        # Spawned, not forked: the caller may already have threads running and
+        # a GL context open, neither of which is safe to fork
+        context = mp.get_context("spawn")
+        self.conns, self.processes = [], []
+        for strip in range(1, self.strips):
+            parent, child = context.Pipe()
+            process = context.Process(target=_strip_worker, args=(child, strip), daemon=True)
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+
+    def _allocate(self, capacity: int) -> None:
+        # Workers notice the new block by name on their next message
+        old = self.shm
+        self.views = None
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=_block_size(capacity, self.strips))
+        self.views = _layout(self.shm.buf, capacity, self.strips)
+        if old is not None:
+            old.close()
+            old.unlink()
+
+    def bounds(self, x: np.ndarray) -> np.ndarray:
+        # Cut columns at body-count quantiles; the outer strips are open-ended
+        columns = hash_pos(x)
+        cuts = np.quantile(columns, np.arange(1, self.strips) / self.strips, method="lower") if len(columns) else np.zeros(self.strips - 1)
+        return np.concatenate([[-np.inf], cuts, [np.inf]])
+
+    def __call__(self, pos: np.ndarray, radius: np.ndarray, imune: np.ndarray, active: np.ndarray = None) -> np.ndarray:
+        if len(pos) < self.min_bodies:
+            return handle_collisions(pos, radius, imune, active)
+        if active is None or active.all():
+            return self._solve(pos, radius, imune, np.ones(len(pos), dtype=bool))
+
+        # Only bodies within reach of an active one take part
+        subset = np.flatnonzero(near_active(pos, radius, active))
+        part = pos[subset]
+        touched = np.zeros(len(pos), dtype=bool)
+        touched[subset] = self._solve(part, radius[subset], imune[subset], active[subset])
+        pos[subset] = part
+        return touched
+
+    def _solve(self, pos: np.ndarray, radius: np.ndarray, imune: np.ndarray, active: np.ndarray) -> np.ndarray:
+        n = len(pos)
+        if n > self.capacity:
+            self._allocate(max(n, self.capacity * 2))
+        views = self.views
+        views["pos"][:n] = pos
+        views["radius"][:n] = radius
+        views["imune"][:n] = imune
+        views["active"][:n] = active
+
+        edges = self.bounds(pos[:, 0])
+        for strip, conn in enumerate(self.conns, 1):
+            conn.send((self.shm.name, self.capacity, self.strips, n, edges[strip], edges[strip + 1]))
+        solve_strip(views, 0, n, edges[0], edges[1])
+        for conn in self.conns:
+            conn.recv()
+
+        pos += views["correction"][:, :n].sum(axis=0)
+        return views["touched"][:, :n].any(axis=0)
+
+    def close(self) -> None:
+        for conn in self.conns:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
+        self.conns, self.processes = [], []
+        if self.shm is not None:
+            self.views = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
@@ -0,0 +1,24 @@
+import numpy as np
+
+from particles import ParticleStore
+
+
+def test_spawn_into_pool_of_immune_bodies_adds_nothing():
+    store = ParticleStore(trail_samples=0, limit=4)
+    for i in range(4):
+        store.add(None, 10, (i * 50, 0), (1, 1, 1), True, 0.0)
+    rows = store.spawn(np.full(3, 5.0), np.zeros((3, 2)), (1, 0, 0), 1.0)
+    assert len(rows) == 0
+    assert store.count == 4
+    assert store.capacity == 4
+    assert store.imune[:store.count].all()
+
+
+def test_spawn_keeps_last_bodies_that_fit():
+    store = ParticleStore(trail_samples=0, limit=4)
+    for i in range(3):
+        store.add(None, 10, (i * 50, 0), (1, 1, 1), True, 0.0)
+    rows = store.spawn(np.array([1.0, 2.0, 3.0]), np.zeros((3, 2)), (1, 0, 0), 1.0)
+    assert store.count == 4
+    assert store.capacity == 4
+    assert store.radius[rows].tolist() == [3.0]
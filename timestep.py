@@ -0,0 +1,26 @@
+class FixedStepper:
+    # Turns variable frame times into a whole number of fixed physics steps.
+    # Leftover time stays in the accumulator; alpha is how far the renderer
+    # should blend from the previous physics state to the current one.
+    def __init__(self, rate: float, max_steps: int):
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float) -> None:
+        self.rate = rate
+        self.dt = 1 / rate
+
+    def advance(self, frame_time: float) -> int:
+        self.accumulator += frame_time
+        steps = int(self.accumulator // self.dt)
+        if steps > self.max_steps:
+            # Too far behind: run the capped steps and drop the backlog
+            steps = self.max_steps
+            self.accumulator = steps * self.dt
+        self.accumulator -= steps * self.dt
+        return steps
+
+    @property
+    def alpha(self) -> float:
+        return min(self.accumulator / self.dt, 1.0)
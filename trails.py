@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class TrailBuffer:
+    # Fixed-capacity ring of (position, timestamp) samples per particle slot.
+    # Row r holds slot r's samples; head[r] is the oldest and length[r] the
+    # number of live samples, so trimming only moves head forward.
+    def __init__(self, capacity: int, samples: int):
+        self.samples = samples
+        self.pos = np.zeros((capacity, samples, 2), dtype=np.float32)
+        self.time = np.zeros((capacity, samples))
+        self.head = np.zeros(capacity, dtype=np.int64)
+        self.length = np.zeros(capacity, dtype=np.int64)
+
+    def resize(self, capacity: int) -> None:
+        old = len(self.head)
+        keep = min(old, capacity)
+        for name, shape in (("pos", (capacity, self.samples, 2)), ("time", (capacity, self.samples)), ("head", (capacity,)), ("length", (capacity,))):
+            array = getattr(self, name)
+            grown = np.zeros(shape, dtype=array.dtype)
+            grown[:keep] = array[:keep]
+            setattr(self, name, grown)
+
+    def clear(self, row: int) -> None:
+        self.head[row] = 0
+        self.length[row] = 0
+
+    def move(self, dst: int, src: int) -> None:
+        self.pos[dst] = self.pos[src]
+        self.time[dst] = self.time[src]
+        self.head[dst] = self.head[src]
+        self.length[dst] = self.length[src]
+
+    def push(self, rows: np.ndarray, pos: np.ndarray, now: float) -> None:
+        # A full ring overwrites its oldest sample
+        slot = (self.head[rows] + self.length[rows]) % self.samples
+        self.pos[rows, slot] = pos
+        self.time[rows, slot] = now
+        full = self.length[rows] == self.samples
+        self.head[rows[full]] = (self.head[rows[full]] + 1) % self.samples
+        self.length[rows[~full]] += 1
+
+    def _ordered(self, rows: slice | np.ndarray) -> np.ndarray:
+        # Ring indices of each row's samples, oldest first
+        return (self.head[rows, None] + np.arange(self.samples)) % self.samples
+
+    def trim(self, rows: slice | np.ndarray, now: float, max_age: float) -> None:
+        # Samples are pushed in time order, so the expired ones are a prefix
+        order = self._ordered(rows)
+        times = np.take_along_axis(self.time[rows], order, axis=1)
+        live = np.arange(self.samples) < self.length[rows, None]
+        expired = (live & (now - times >= max_age)).sum(axis=1)
+        self.head[rows] = (self.head[rows] + expired) % self.samples
+        self.length[rows] -= expired
+
+    def block(self, count: int) -> tuple[np.ndarray, np.ndarray]:
+        # Contiguous sample storage for rows [0, count), e.g. for a GPU upload
+        return self.pos[:count], self.time[:count]
+
+    def gather(self, rows: slice) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Live samples as flat (row, pos, time) arrays, grouped by row and
+        # oldest first within each row
+        start = rows.start or 0
+        order = self._ordered(rows)
+        live = np.arange(self.samples) < self.length[rows, None]
+        owner, k = np.nonzero(live)
+        ring = order[owner, k]
+        owner = owner + start
+        return owner, self.pos[owner, ring], self.time[owner, ring]
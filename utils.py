@@ -1,68 +1,150 @@
 from OpenGL.GL import *
 from pygame.math import Vector2
-from math import cos, sin, pi
+from math import pi
 import pygame
 import numpy as np
+import ctypes
+from functools import lru_cache
+from assetcache import cached_arrays, file_key
+from consts import SPLINE_SEGMENTS
 
 def snap_to_note(freq, base=440.0):
-    # Convert to MIDI-like index
-    if freq <= 0:
-        return 0.0
-    note_index = round(12 * np.log2(freq / base))
-    return base * (2 ** (note_index / 12))
-
+    # Convert to MIDI-like index; works on scalars and arrays
+    freq = np.asarray(freq, dtype=float)
+    audible = freq > 0
+    note_index = np.round(12 * np.log2(np.where(audible, freq, base) / base))
+    snapped = np.where(audible, base * (2 ** (note_index / 12)), 0.0)
+    return float(snapped) if snapped.ndim == 0 else snapped
+
+
+@lru_cache(maxsize=None)
+def catmull_rom_basis(segments: int) -> np.ndarray:
+    # Weights of p0..p3 at segments + 1 evenly spaced t, so a whole curve
+    # segment is one matrix product
+    t = np.linspace(0, 1, segments + 1)
+    t2 = t * t
+    t3 = t2 * t
+    return 0.5 * np.stack([
+        -t + 2*t2 - t3,
+        2 - 5*t2 + 3*t3,
+        t + 4*t2 - 3*t3,
+        -t2 + t3,
+    ], axis=1)
+
+def catmull_rom_loops(points: np.ndarray, segments: int = 20) -> np.ndarray:
+    # points is (loops, n, 2); returns (loops, n * (segments + 1), 2) vertices
+    # in the same order draw_catmull_rom emits them
+    loops, n, _ = points.shape
+    windows = np.stack([np.roll(points, -k, axis=1) for k in range(4)], axis=2)
+    curve = np.einsum("sk,lnkd->lnsd", catmull_rom_basis(segments), windows)
+    return curve.reshape(loops, n * (segments + 1), 2)
+
+def segments_for_radius(radius: float, points: int, max_segments: int = SPLINE_SEGMENTS, pixels_per_segment: float = 4) -> int:
+    # Enough segments that each is about pixels_per_segment long on screen
+    arc = 2 * pi * radius / points
+    return int(np.clip(np.ceil(arc / pixels_per_segment), 2, max_segments))
 
 def draw_catmull_rom(points: list[Vector2], segments: int = 20, loop: bool = False) -> None:
     if len(points) < 4:
         return  # Need at least 4 points for Catmull-Rom
 
-    glBegin(GL_POLYGON)
-
-    n = len(points)
-    for i in range(n):
-        p0 = points[i % n]
-        p1 = points[(i + 1) % n]
-        p2 = points[(i + 2) % n]
-        p3 = points[(i + 3) % n]
-
-        for j in range(segments + 1):
-            t = j / segments
-            t2 = t * t
-            t3 = t2 * t
-
-            # Catmull-Rom spline formula
-            point = 0.5 * (
-                (2 * p1) +
-                (-p0 + p2) * t +
-                (2*p0 - 5*p1 + 4*p2 - p3) * t2 +
-                (-p0 + 3*p1 - 3*p2 + p3) * t3
-            )
-
-            glVertex2d(point.x, point.y)
-
-    glEnd()
-
+    vertices = catmull_rom_loops(np.array([tuple(p) for p in points])[None], segments)[0]
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glVertexPointer(2, GL_DOUBLE, 0, vertices)
+    glDrawArrays(GL_POLYGON, 0, len(vertices))
+    glDisableClientState(GL_VERTEX_ARRAY)
+
+
+class PolygonBatch:
+    # Filled polygons collected into one dynamic VBO (x, y, r, g, b, a per
+    # vertex) and drawn with a single glMultiDrawArrays
+    def __init__(self, capacity: int = 8192):
+        self.vbo = glGenBuffers(1)
+        self.gpu_capacity = 0
+        self.data = np.zeros((capacity, 6), dtype=np.float32)
+        self.count = 0
+        self.firsts = []
+        self.counts = []
+
+    def add(self, polygons: np.ndarray, color) -> None:
+        # polygons is (k, m, 2): k polygons of m vertices sharing one color
+        k, m, _ = polygons.shape
+        needed = self.count + k * m
+        if needed > len(self.data):
+            data = np.zeros((max(needed, len(self.data) * 2), 6), dtype=np.float32)
+            data[:self.count] = self.data[:self.count]
+            self.data = data
+        rows = self.data[self.count:needed]
+        rows[:, :2] = polygons.reshape(-1, 2)
+        rows[:, 2:] = np.repeat(np.broadcast_to(np.asarray(color, dtype=np.float32), (k, 4)), m, axis=0)
+        self.firsts.extend(range(self.count, needed, m))
+        self.counts.extend([m] * k)
+        self.count = needed
+
+    def flush(self) -> None:
+        if self.count == 0:
+            return
+        vertices = self.data[:self.count]
+
+        glUseProgram(0)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        if self.count > self.gpu_capacity:
+            self.gpu_capacity = len(self.data)
+            glBufferData(GL_ARRAY_BUFFER, self.data.nbytes, None, GL_STREAM_DRAW)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, vertices.nbytes, vertices)
+
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(2, GL_FLOAT, 24, ctypes.c_void_p(0))
+        glColorPointer(4, GL_FLOAT, 24, ctypes.c_void_p(8))
+        glMultiDrawArrays(GL_POLYGON, np.array(self.firsts, dtype=np.int32), np.array(self.counts, dtype=np.int32), len(self.counts))
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        self.count = 0
+        self.firsts.clear()
+        self.counts.clear()
+
+
+@lru_cache(maxsize=None)
+def unit_circle(points: int) -> np.ndarray:
+    angle = pi * 2 * np.arange(points) / points
+    return np.stack([np.cos(angle), np.sin(angle)], axis=1)
 
 def drawCircle(center: Vector2, radius: float, points: int = 20):
-    glBegin(GL_POLYGON)
-    for i in range(points):
-        glVertex2d(center.x + cos(pi * 2 * i / points)*radius, center.y + sin(pi * 2 * i / points)* radius)
-    glEnd()
+    vertices = unit_circle(points) * radius + (center.x, center.y)
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glVertexPointer(2, GL_DOUBLE, 0, vertices)
+    glDrawArrays(GL_POLYGON, 0, points)
+    glDisableClientState(GL_VERTEX_ARRAY)
 
 def rgb255(r: int, g: int, b: int, a: int = 255) -> tuple[float, float, float, float]:
     return r / 255.0, g / 255.0, b / 255.0, a / 255.0
 
-def load_texture(path: str) -> int:
-    image = pygame.image.load(path)
+def surface_pixels(image: pygame.Surface) -> np.ndarray:
+    # RGBA rows as uploaded to OpenGL
     image = pygame.transform.flip(image, False, True)  # Flip for OpenGL
-    image_data = pygame.image.tostring(image, "RGBA", 1)
     width, height = image.get_size()
+    return np.frombuffer(pygame.image.tostring(image, "RGBA", 1), dtype=np.uint8).reshape(height, width, 4)
 
-    texture_id = glGenTextures(1)
+def load_texture(path: str) -> int:
+    # Decoded pixels are cached by the file's contents, skipping the PNG decode
+    pixels, = cached_arrays("texture", file_key(path), lambda: [surface_pixels(pygame.image.load(path))])
+    return upload_texture(pixels)
+
+def surface_texture(image: pygame.Surface, texture_id: int = None) -> int:
+    # Uploads a surface, reusing texture_id when given
+    return upload_texture(surface_pixels(image), texture_id)
+
+def upload_texture(pixels: np.ndarray, texture_id: int = None) -> int:
+    height, width = pixels.shape[:2]
+    if texture_id is None:
+        texture_id = glGenTextures(1)
     glBindTexture(GL_TEXTURE_2D, texture_id)
     
     glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height,
-                 0, GL_RGBA, GL_UNSIGNED_BYTE, image_data)
+                 0, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
     
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
@@ -82,13 +164,3 @@ def draw_image(texture_id, x, y, width, height):
     glEnd()
 
     glDisable(GL_TEXTURE_2D)
-
-
-# def fade_screen(alpha=0.1):
-#     glColor4f(0.0, 0.0, 0.0, alpha)  # low alpha = longer trails
-#     glBegin(GL_QUADS)
-#     glVertex2f(0, 0)
-#     glVertex2f(WIDTH, 0)
-#     glVertex2f(WIDTH, HEIGHT)
-#     glVertex2f(0, HEIGHT)
-#     glEnd()
\ No newline at end of file
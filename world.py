@@ -0,0 +1,149 @@
+import random
+import time
+import numpy as np
+
+from pygame.math import Vector2
+from blob import Blob, BlobStore, Body
+from particles import ParticleStore
+from collisions import handle_collisions
+from strips import StripSolver
+from audioManager import VoiceBoard
+from capture import LandmarkFilter, PoseSample, prediction_horizon, RIGHT_WRIST, LEFT_WRIST, X, Y, VISIBILITY
+from profiler import FrameProfiler
+from consts import *
+
+
+def collide_world(particles: ParticleStore, blobs: BlobStore, hand: Body, now: float, solve=handle_collisions):
+    n = len(particles)
+    m = len(blobs.pos)
+    pos = np.concatenate([particles.pos[:n], blobs.pos, [tuple(hand.pos)]])
+    radius = np.concatenate([particles.radius[:n], np.zeros(m), [hand.radius]])
+    imune = np.concatenate([particles.imune[:n], np.zeros(m, dtype=bool), [hand.imune]])
+    asleep = particles.asleep[:n]
+    active = np.concatenate([~asleep, np.ones(m + 1, dtype=bool)])
+
+    touched = solve(pos, radius, imune, active)
+
+    # A sleeper pushed harder than it could drift wakes up; a lighter nudge,
+    # like the leftover overlap in a resting pile, is dropped
+    sleepers = np.flatnonzero(asleep)
+    if len(sleepers):
+        push = pos[sleepers] - particles.pos[sleepers]
+        woken = (push ** 2).sum(axis=1) > SLEEP_SPEED ** 2
+        particles.wake(sleepers[woken])
+        pos[sleepers[~woken]] = particles.pos[sleepers[~woken]]
+        touched[sleepers[~woken]] = False
+
+    particles.pos[:n] = pos[:n]
+    blobs.pos[:] = pos[n:n + m]
+
+    # Contact restarts a particle's note
+    particles.onset[:n][touched[:n]] = now
+
+
+class World:
+    # Everything the physics step touches: particles, blobs and the hand.
+    # clock and seed make a run reproducible when driven from a recording.
+    def __init__(self, width: int, height: int, clock=time.time, seed: int = None, profiler: FrameProfiler = None, trail_samples: int = TRAIL_SAMPLES,
+                 max_particles: int = MAX_PARTICLES, collision_workers: int = COLLISION_WORKERS, pose_hz: float = POSE_INFERENCE_HZ):
+        self.width = width
+        self.height = height
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.profiler = profiler if profiler is not None else FrameProfiler([])
+        self.particles = ParticleStore(trail_samples=trail_samples, limit=max_particles)
+        self.blobs = BlobStore()
+        self.rightHand = Body(100, Vector2(0, 0), (1, 1, 1), True, spawn_time=clock())
+        self.voices = VoiceBoard(max_particles)
+        self.solve = StripSolver(collision_workers, max_particles + 256) if collision_workers > 0 else handle_collisions
+        self.pose_filter = LandmarkFilter(horizon=prediction_horizon(pose_hz))
+        self.landmarks = None  # Filtered pose for this frame
+        self.lastSpawn = clock()
+        self.colorCounter = 0
+
+    def close(self) -> None:
+        if isinstance(self.solve, StripSolver):
+            self.solve.close()
+
+    def to_pixels(self, landmark) -> Vector2:
+        return Vector2(landmark[X] * self.width, landmark[Y] * self.height)
+
+    def apply_pose(self, sample: PoseSample | None, newPose: bool) -> None:
+        # New readings go through the filter; the hand and spawning follow its
+        # prediction every frame, however slowly poses arrive
+        if newPose:
+            self.pose_filter.update(sample.landmarks, sample.timestamp)
+        now = self.clock()
+        landmarks = self.landmarks = self.pose_filter.predict(now)
+        if landmarks is None:
+            self.rightHand.pos = Vector2(-self.rightHand.radius, -self.rightHand.radius)
+            return
+        self.rightHand.pos = self.to_pixels(landmarks[RIGHT_WRIST])
+        if landmarks[LEFT_WRIST, VISIBILITY] < 0.5:
+            return
+
+        # A held pose is not moving, whatever velocity the filter last had
+        if self.pose_filter.stale(now):
+            return
+
+        # Filtered wrist velocity, in pixels per pose at the rate the spawn
+        # constants were tuned at
+        wrist = self.to_pixels(landmarks[LEFT_WRIST])
+        velocity = self.pose_filter.velocity[LEFT_WRIST]
+        wristSpeedDir = Vector2(velocity[X] * self.width, velocity[Y] * self.height) / POSE_REFERENCE_HZ
+        wristSpeed = wristSpeedDir.magnitude()
+
+        if wristSpeed > 0 and (now - self.lastSpawn) * 1000 > tunables.spawn_delay / wristSpeed:
+            radius = MAX_PARTICLE_RADIUS / wristSpeed
+            color = colors[self.colorCounter]
+            if radius > MAX_PARTICLE_RADIUS / 3:
+                Blob(wrist, 16, radius, color, store=self.blobs, spawn_time=now)
+            elif radius > 1:
+                self.particles.spawn(radius, wrist, color, now, wristSpeedDir * 10)
+            self.lastSpawn = now
+            self.colorCounter = (self.colorCounter + 1) % len(colors)
+
+    def step(self, dt: float) -> None:
+        currentTime = self.clock()
+        rng = self.rng
+        particles = self.particles
+        particles.save_state()
+        blobs = self.blobs
+        blobs.save_state()
+
+        # An expired blob bursts into particles, one per point
+        expired = blobs.expired(currentTime, MAX_PARTICLE_AGE)
+        for k in expired:
+            points = blobs.pos[blobs.points_of(k)]
+            draws = np.array([rng.random() for _ in range(3 * len(points))]).reshape(-1, 3)
+            particles.spawn(draws[:, 0] * 30, points, blobs.colors[k], currentTime, (draws[:, 1:] * 2 - 1) * 200)
+        if len(expired):
+            blobs.remove(expired)
+
+        blobs.update(dt)
+        blobs.constrain_to_bounds(self.width, self.height)
+        self.profiler.lap("blobs")
+
+        collide_world(particles, blobs, self.rightHand, currentTime, self.solve)
+        self.profiler.lap("collide")
+
+        particles.expire(currentTime, MAX_PARTICLE_AGE)
+        particles.update(dt, now=currentTime)
+        particles.constrain_to_bounds(self.width, self.height)
+        particles.publish_voices(self.voices)
+        self.profiler.lap("particles")
+
+    def draw(self, renderer, polygons, alpha: float, feedback=None) -> None:
+        self.blobs.draw(polygons, alpha)
+        self.profiler.lap("draw_blobs")
+
+        if feedback is not None:
+            feedback.update(renderer, self.particles, self.clock(), alpha)
+            feedback.composite()
+        else:
+            renderer.begin()
+            self.particles.draw(renderer, self.clock(), alpha)
+            renderer.flush()
+        self.profiler.lap("draw_particles")
+
+        # self.rightHand.draw(renderer)